@@ -19,17 +19,21 @@ CLASSIFIERS = [
     "License :: OSI Approved :: ISC License (ISCL)",
     "Operating System :: OS Independent",
     "Programming Language :: Python",
-    "Programming Language :: Python :: 2",
-    "Programming Language :: Python :: 2.7",
     "Programming Language :: Python :: 3",
-    "Programming Language :: Python :: 3.4",
-    "Programming Language :: Python :: 3.5",
+    "Programming Language :: Python :: 3 :: Only",
+    "Programming Language :: Python :: 3.6",
+    "Programming Language :: Python :: 3.7",
+    "Programming Language :: Python :: 3.8",
     "Programming Language :: Python :: Implementation :: CPython",
     "Programming Language :: Python :: Implementation :: PyPy",
     "Topic :: Software Development :: Libraries :: Python Modules",
 ]
+PYTHON_REQUIRES = ">=3.6"
 INSTALL_REQUIRES = ["ndeflib", "click", "python-magic"]
-CONSOLE_SCRIPTS = ['ndeftool=ndeftool.cli:main']
+CONSOLE_SCRIPTS = [
+    'ndeftool=ndeftool.cli:main',
+    'ndeftool-client=ndeftool.daemon:client_main',
+]
 
 ###############################################################################
 
@@ -78,6 +82,7 @@ if __name__ == "__main__":
         package_dir={"": "src"},
         zip_safe=False,
         classifiers=CLASSIFIERS,
+        python_requires=PYTHON_REQUIRES,
         install_requires=INSTALL_REQUIRES,
         entry_points={'console_scripts': CONSOLE_SCRIPTS},
     )
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Persistent caches in the directory given by --cache-dir.
+
+All caches are tables of one SQLite database. Lookups read from the
+database, additions and the recency of lookups are collected and
+written in a single transaction when the cache is closed, so that
+concurrent ndeftool runs block each other only briefly. Each table
+holds a bounded number of entries, and some tables a bounded number
+of value octets, and the least recently used entries are evicted
+first.
+
+"""
+import os
+import time
+import sqlite3
+
+DATABASE = 'cache.sqlite'
+
+# The maximum number of entries per table.
+TABLES = {
+    'mimetype': 100000,
+    'digest': 100000,
+    'decode': 100000,
+}
+
+# The maximum number of value octets for tables with large values.
+OCTETS = {
+    'decode': 64 << 20,
+}
+
+
+class CacheError(Exception):
+    pass
+
+
+def stat_key(file_stat):
+    """Return a cache key for the file with the os.stat() result
+    file_stat, which changes when the file is replaced or modified.
+
+    """
+    return 'stat:%d:%d:%d:%d' % (file_stat.st_dev, file_stat.st_ino,
+                                 file_stat.st_size, file_stat.st_mtime_ns)
+
+
+class Cache(object):
+    def __init__(self, directory):
+        self.path = os.path.join(directory, DATABASE)
+        self.updates = {}
+        self.touched = set()
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.db = sqlite3.connect(self.path, timeout=10)
+            for table in TABLES:
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY,"
+                    " value BLOB NOT NULL, used REAL NOT NULL)" % table)
+            self.db.commit()
+        except (OSError, sqlite3.Error) as error:
+            raise CacheError("can not open cache %s: %s" % (self.path, error))
+
+    def get(self, table, key):
+        """Return the value stored for key in table, or None."""
+        value = self.updates.get((table, key))
+        if value is None:
+            try:
+                row = self.db.execute(
+                    "SELECT value FROM %s WHERE key = ?" % table,
+                    (key,)).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is not None:
+                value = row[0]
+                self.touched.add((table, key))
+        return value
+
+    def put(self, table, key, value):
+        self.updates[(table, key)] = value
+
+    def stats(self):
+        """Return a list of (table, entries, octets) for all tables."""
+        try:
+            return [(table,) + tuple(self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0)"
+                " FROM %s" % table).fetchone()) for table in sorted(TABLES)]
+        except sqlite3.Error as error:
+            raise CacheError("can not read cache %s: %s" % (self.path, error))
+
+    def clear(self, tables=None):
+        """Remove all entries of the tables given, or of all tables, and
+        release the space in the database file.
+
+        """
+        tables = sorted(tables or TABLES)
+        for key in list(self.updates):
+            if key[0] in tables:
+                del self.updates[key]
+        try:
+            with self.db:
+                for table in tables:
+                    self.db.execute("DELETE FROM %s" % table)
+            self.db.execute("VACUUM")
+        except sqlite3.Error as error:
+            raise CacheError("can not clear cache %s: %s" % (self.path, error))
+
+    def close(self):
+        """Write the collected updates, evict the least recently used
+        entries and close the database. A database that is busy for
+        too long or not writable only means that updates are lost.
+        Eviction runs in a transaction of its own, so that an error
+        there does not lose the updates.
+
+        """
+        used = time.time()
+        tables = set(table for table, _ in self.updates)
+        tables.update(table for table, _ in self.touched)
+        try:
+            with self.db:
+                for table in tables:
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO %s VALUES (?, ?, ?)" % table,
+                        [(key, value, used) for (name, key), value
+                         in self.updates.items() if name == table])
+                    self.db.executemany(
+                        "UPDATE %s SET used = ? WHERE key = ?" % table,
+                        [(used, key) for name, key in self.touched
+                         if name == table])
+            with self.db:
+                for table in tables:
+                    self.evict(table)
+        except sqlite3.Error:
+            pass
+        finally:
+            self.db.close()
+
+    def evict(self, table):
+        # The value octets are added up here, a window function would
+        # need SQLite 3.25 or later.
+        self.db.execute(
+            "DELETE FROM %s WHERE key IN (SELECT key FROM %s"
+            " ORDER BY used DESC LIMIT -1 OFFSET ?)"
+            % (table, table), (TABLES[table],))
+        if table in OCTETS:
+            total, evicted = 0, []
+            for key, octets in self.db.execute(
+                    "SELECT key, LENGTH(value) FROM %s"
+                    " ORDER BY used DESC, key" % table):
+                total += octets
+                if total > OCTETS[table]:
+                    evicted.append((key,))
+            self.db.executemany(
+                "DELETE FROM %s WHERE key = ?" % table, evicted)
@@ -1,12 +1,21 @@
 # -*- coding: utf-8 -*-
 
 from functools import wraps
+import collections
+import itertools
 import os.path
+import sys
+import io
+import re
 import click
 import ndef
 
+from ndeftool import __version__
+
 version_message = '%%(prog)s %%(version)s (ndeflib %s)' % ndef.__version__
 command_plugins = os.path.join(os.path.dirname(__file__), 'commands')
+short_help_pattern = re.compile(r"""short_help=(['"])(.*?)\1""")
+_command_registry = None
 
 
 def echo(*args, **kwargs):
@@ -27,43 +36,58 @@ def warn(*args):
     click.secho(*args, err=True, fg='red')
 
 
-class CommandGroup(click.Group):
-    def list_commands(self, ctx):
-        command_list = []
+def command_registry():
+    """Return the mapping of lower case full and abbreviated command
+    names to (command name, module name, short help) tuples. The
+    registry is built once per process from the command_plugins
+    folder without importing any of the command modules.
+
+    """
+    global _command_registry
+    if _command_registry is None:
+        registry = {}
 
         # All commands are separate Python files within the
-        # command_plugins folder.
+        # command_plugins folder. The upper case letters of the file
+        # name construct the abbreviated command name. The short help
+        # text is read from the source file so that no command module
+        # needs to be imported for listing the commands.
         for filename in sorted(os.listdir(command_plugins)):
             basename, extension = os.path.splitext(filename)
             if extension == '.py' and basename != '__init__':
-                command_list.append(basename)
+                cmd_abbr = ''.join(x for x in basename if 'A' <= x <= 'Z')
+                with open(os.path.join(command_plugins, filename)) as f:
+                    cmd_help = short_help_pattern.search(f.read())
+                entry = (basename, 'ndeftool.commands.' + basename,
+                         cmd_help.group(2) if cmd_help else '')
+                registry[basename.lower()] = entry
+                registry[cmd_abbr.lower()] = entry
+
+        _command_registry = registry
+    return _command_registry
+
 
-        return command_list
+class CommandGroup(click.Group):
+    def list_commands(self, ctx):
+        return sorted(set(entry[0] for entry in command_registry().values()))
 
     def get_command(self, ctx, name):
-        name = name.lower()  # all commands treated case insensitive
-
-        # From list_commands() we get the command file names without
-        # extension. We use the upper case letters to construct the
-        # abbreviated name and import the module if the requested
-        # command name matches either the lower case full or short
-        # name.
-        for cmd_name in self.list_commands(ctx):
-            cmd_abbr = ''.join(x for x in cmd_name if 'A' <= x <= 'Z')
-            if name in (cmd_name.lower(), cmd_abbr.lower()):
-                module = 'ndeftool.commands.' + cmd_name
-                return __import__(module, None, None, ['cmd']).cmd
+        # All commands are treated case insensitive and may be given
+        # by either the full or the abbreviated name. The command
+        # module is only imported when it is actually requested.
+        entry = command_registry().get(name.lower())
+        if entry is not None:
+            return __import__(entry[1], None, None, ['cmd']).cmd
 
     def format_commands(self, ctx, formatter):
         rows = []
 
-        # From list_commands() we get the command file names without
-        # extension. We use the upper case letters to construct the
-        # abbreviated name and store lower case versions of short and
-        # long command name.
-        for cmd_name in self.list_commands(ctx):
+        # From the command registry we get the command names and the
+        # short help text. We use the upper case letters to construct
+        # the abbreviated name and store lower case versions of short
+        # and long command name.
+        for cmd_name, _, cmd_help in set(command_registry().values()):
             cmd_abbr = ''.join(x for x in cmd_name if 'A' <= x <= 'Z')
-            cmd_help = self.get_command(ctx, cmd_name).short_help or ''
             rows.append((cmd_abbr.lower(), cmd_name.lower(), cmd_help))
 
         # We want the command list to be sorted by abbreviated command
@@ -76,7 +100,7 @@ class CommandGroup(click.Group):
 
 
 @click.command(cls=CommandGroup, chain=True)
-@click.version_option(message=version_message)
+@click.version_option(version=__version__, message=version_message)
 @click.option('--relax', 'errors', flag_value='relax',
               help='Ignore some errors when decoding.')
 @click.option('--ignore', 'errors', flag_value='ignore',
@@ -85,6 +109,21 @@ class CommandGroup(click.Group):
               help='Suppress all progress information.')
 @click.option('--debug', 'logmsg', flag_value='debug',
               help='Output debug progress information.')
+@click.option('--stream', is_flag=True,
+              help='Stream records through the pipeline.')
+@click.option('--split', is_flag=True,
+              help='Run the pipeline for each message on stdin.')
+@click.option('--buffer-size', type=click.IntRange(min=0), default=65536,
+              metavar='N', help='Flush standard output every N octets.')
+@click.option('--cache-dir', type=click.Path(file_okay=False), metavar='DIR',
+              envvar='NDEFTOOL_CACHE_DIR',
+              help='Keep persistent caches in DIR.')
+@click.option('--detect', type=click.Choice(['fast', 'magic']),
+              default='fast', help='Mimetype detection strategy.')
+@click.option('--stats', is_flag=True,
+              help='Print per command statistics to stderr.')
+@click.option('--profile', type=click.Path(dir_okay=False), metavar='FILE',
+              help='Write cProfile statistics to FILE.')
 @click.pass_context
 def main(ctx, **kwargs):
     """Create or inspect NFC Data Exchange Format messages.
@@ -117,25 +156,350 @@ def main(ctx, **kwargs):
       ndeftool text 'one' save text_1.ndef text 'two' save text_2.ndef
       ndeftool load text_1.ndef print load text_2.ndef print
 
+    By default each command receives the complete list of records
+    from the previous command. With --stream the records are passed
+    on one at a time as they are loaded or decoded, so that a large
+    message is processed in bounded memory. Commands that need to see
+    the whole message, for example to change the last record, still
+    collect all records before they run.
+
+    \b
+      ndeftool --stream load big.ndef print
+
+    With --split the standard input is read as a sequence of NDEF
+    messages and the pipeline runs once for each message, starting
+    with its records. Only one message is decoded at a time.
+
+    \b
+      cat messages.ndef | ndeftool --split print
+      ndeftool --split save --force last.ndef < messages.ndef
+
+    With --stats a table is printed to standard error when the
+    pipeline has finished. For each command it shows the time spent,
+    the number of records received and produced, the number of octets
+    decoded and encoded, and the growth of peak memory use. With
+    --profile the whole pipeline runs under the Python profiler and
+    the statistics are written to FILE for inspection with pstats.
+
+    \b
+      ndeftool --stats load big.ndef save copy.ndef
+      ndeftool --profile load.prof load big.ndef print
+
+    With --cache-dir, or the NDEFTOOL_CACHE_DIR environment variable,
+    the mimetypes discovered for packed files and smartposter icons
+    are kept in DIR, so that unchanged files need not be examined by
+    libmagic again on the next run. The default --detect strategy
+    'fast' recognizes common file types by signature or extension
+    and only asks libmagic if that is inconclusive, 'magic' always
+    asks libmagic. The cache also keeps the record layout of NDEF
+    files decoded by load, by content hash and decode errors mode, so
+    that the same content is not parsed and validated again. Use the
+    cache command to show or clear the cache.
+
     Each command has it's own help page: 'ndeftool <cmd> --help'
     """
     ctx.meta['decode-errors'] = kwargs['errors'] or 'strict'
     ctx.meta['output-logmsg'] = kwargs['logmsg'] or 'normal'
+    ctx.meta['pipeline-stream'] = kwargs['stream']
+    ctx.meta['cache-dir'] = kwargs['cache_dir']
+    ctx.meta['mimetype-detect'] = kwargs['detect']
+    if kwargs['stats']:
+        from ndeftool.stats import PipelineStats
+        ctx.meta['pipeline-stats'] = PipelineStats()
 
 
 @main.result_callback()
 def process_commands(processors, **kwargs):
-    message = None
-    for processor in processors:
-        message = processor(message)
-        dmsg('records = ' + str(message))
-    echo(b''.join(ndef.message_encoder(message)), nl=False)
+    if kwargs['profile']:
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.runcall(watch_commands, processors, **kwargs)
+        finally:
+            profile.dump_stats(kwargs['profile'])
+    else:
+        watch_commands(processors, **kwargs)
+
+
+def watch_commands(processors, **kwargs):
+    """Run the commands once or, if a load --watch command created a
+    watcher, again after each change of the watched files until the
+    process is interrupted. An error in a later run is shown and the
+    files are watched for the next change.
+
+    """
+    ctx = click.get_current_context()
+    run_commands(processors, **kwargs)
+    watcher = ctx.meta.get('load-watch')
+    if watcher is None:
+        return
+    try:
+        while True:
+            watcher.wait()
+            watcher.begin()
+            info("Files changed, running the pipeline again.")
+            if kwargs['stats']:
+                from ndeftool.stats import PipelineStats
+                ctx.meta['pipeline-stats'] = PipelineStats()
+            try:
+                run_commands(processors, **kwargs)
+            except click.ClickException as error:
+                error.show()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+def run_commands(processors, **kwargs):
+    stdout = click.get_binary_stream('stdout')
+    stats = click.get_current_context().meta.get('pipeline-stats')
+    # Formatting the records reads the payload of lazy file records.
+    debug = click.get_current_context().meta['output-logmsg'] == 'debug'
+    if stats is not None:
+        processors = [stats.wrap_processor(p) for p in processors]
+        output = stats.add_stage('<stdout>')
+    if kwargs['split']:
+        stdin = click.get_binary_stream('stdin')
+        errors = click.get_current_context().meta['decode-errors']
+        messages = split_messages(stdin, errors)
+    else:
+        messages = [None]
+    try:
+        for index, message in enumerate(messages):
+            if kwargs['split']:
+                dmsg('message #%d' % (index + 1))
+            for processor in processors:
+                message = processor(message)
+                if debug and isinstance(message, list):
+                    dmsg('records = ' + str(message))
+            if stats is None:
+                write_message(message, stdout, kwargs['buffer_size'])
+                continue
+            message = stats.records_in(output, message)
+            stats.enter(output)
+            try:
+                output.encoded += write_message(message, stdout,
+                                                kwargs['buffer_size'])
+            finally:
+                stats.leave()
+    finally:
+        if stats is not None:
+            for line in stats.report():
+                click.echo(line, err=True)
+
+
+def write_message(message, stream, buffer_size):
+    """Encode the records of message to the binary stream. Encoded
+    records are collected until there are at least buffer_size octets
+    and then written and flushed, so that the first octets reach the
+    reader of a shell pipe before the whole message is encoded. The
+    number of octets written is returned.
 
+    """
+    buffer = bytearray()
+    written = 0
+    for octets in ndef.message_encoder(message):
+        buffer.extend(octets)
+        written += len(octets)
+        if len(buffer) >= buffer_size:
+            stream.write(buffer)
+            stream.flush()
+            del buffer[:]
+    if buffer:
+        stream.write(buffer)
+    stream.flush()
+    return written
+
+
+def command_processor(func=None, buffered=False):
+    """Decorate a command function to return a pipeline processor. The
+    processor calls the command function with the message produced by
+    the previous command, which is None for the first command, and
+    returns the command function result as the next message.
+
+    A command function may receive and return any iterable of
+    records. Unless the pipeline runs in --stream mode the message is
+    always materialized as a list between commands. A command that
+    must see the whole message sets buffered=True to receive a list
+    also in --stream mode.
+
+    """
+    if func is None:
+        return lambda func: command_processor(func, buffered)
 
-def command_processor(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
         def processor(message):
-            return func(message, *args, **kwargs)
+            stream = click.get_current_context().meta.get('pipeline-stream')
+            if message is not None and not isinstance(message, list):
+                if buffered or not stream:
+                    message = list(message)
+            message = func(message, *args, **kwargs)
+            if message is not None and not isinstance(message, list):
+                if not stream:
+                    message = list(message)
+            return message
+        processor.command = func.__module__.rsplit('.', 1)[-1].lower()
         return processor
     return wrapper
+
+
+def extend(message, records):
+    """Return the message with the records appended. A list message is
+    extended in place unless the pipeline runs in --stream mode, any
+    other iterable message is chained with the records. A None message
+    is the start of a new message.
+
+    """
+    if message is None:
+        return records
+    stream = click.get_current_context().meta.get('pipeline-stream')
+    if isinstance(message, list) and not stream:
+        message.extend(records)
+        return message
+    return itertools.chain(message, records)
+
+
+def decode_stdin():
+    """Return the records decoded from the NDEF message on standard
+    input. In --stream mode this is an iterator that decodes records
+    while standard input is read, otherwise a list. Decode errors are
+    raised as ClickException.
+
+    """
+    meta = click.get_current_context().meta
+    records = decode_message(click.get_binary_stream('stdin'),
+                             meta['decode-errors'])
+    return records if meta.get('pipeline-stream') else list(records)
+
+
+def split_messages(stream, errors):
+    """Yield an iterator over the records of each NDEF message read from
+    the binary stream, until the end of stream. Only the records of the
+    current message are read, records that were not consumed when the
+    next message is requested are skipped.
+
+    """
+    while True:
+        records = decode_message(stream, errors)
+        record = next(records, None)
+        if record is None:
+            return
+        yield itertools.chain([record], records)
+        collections.deque(records, maxlen=0)
+
+
+def decode_message(stream, errors):
+    try:
+        for record in ndef.message_decoder(counted(stream), errors):
+            yield record
+    except ndef.DecodeError as error:
+        raise click.ClickException(str(error))
+
+
+def open_cache():
+    """Return the persistent cache in the --cache-dir directory, or None
+    if no cache directory is set. The cache is opened on first use and
+    closed with the main context. If it can not be opened a warning is
+    shown and the pipeline runs without cache.
+
+    """
+    ctx = click.get_current_context().find_root()
+    if ctx.meta.get('cache-dir') and 'cache' not in ctx.meta:
+        from ndeftool.cache import Cache, CacheError
+        try:
+            ctx.meta['cache'] = Cache(ctx.meta['cache-dir'])
+        except CacheError as error:
+            warn(str(error))
+            ctx.meta['cache'] = None
+        else:
+            ctx.call_on_close(ctx.meta['cache'].close)
+    return ctx.meta.get('cache')
+
+
+def tally(name, value):
+    """Add value to the named counter of the current pipeline stage if
+    the pipeline runs with --stats.
+
+    """
+    stats = click.get_current_context().meta.get('pipeline-stats')
+    if stats is not None:
+        stats.count(name, value)
+
+
+def counted(stream):
+    """Return the binary stream for decoding. If the pipeline runs with
+    --stats the stream is wrapped to count the octets decoded.
+
+    """
+    stats = click.get_current_context().meta.get('pipeline-stats')
+    if stats is not None:
+        from ndeftool.stats import CountingReader
+        stream = CountingReader(stream, stats)
+    return stream
+
+
+def select_range(length, skip, count, head, tail):
+    """Return the index of the first record and the number of records that
+    the --skip, --count, --head and --tail options select from a sequence
+    of length records. The options apply in that order: skip the first
+    skip records, keep at most count and then at most head of the rest,
+    and of those keep the last tail records. A count, head or tail of
+    None (or zero for count and head) does not limit the selection.
+
+    """
+    first = min(skip, length)
+    number = min(length - first, count or length, head or length)
+    if tail is not None and tail < number:
+        first, number = first + number - tail, tail
+    return first, number
+
+
+def run_pipeline(args):
+    """Run the ndeftool command line given by the args list within the
+    current process and return the exit status. Each run creates a
+    new main context, so that global options and ctx.meta are not
+    shared between runs. Errors are reported to standard error as
+    they would be by the ndeftool executable. An unexpected exception
+    is reported by its last traceback line and returns exit status 1,
+    so that it only fails this run and not the caller's batch.
+
+    """
+    try:
+        status = main.main(args, prog_name='ndeftool', standalone_mode=False)
+    except click.ClickException as error:
+        error.show()
+        return error.exit_code
+    except click.Abort:
+        warn("Aborted!")
+        return 1
+    except Exception as error:
+        import traceback
+        errmsg = traceback.format_exception_only(type(error), error)[-1]
+        warn("Error: " + errmsg.strip())
+        return 1
+    return status if isinstance(status, int) else 0
+
+
+def call_pipeline(args, stdin=b''):
+    """Run the ndeftool command line given by the args list with the
+    stdin octets or binary file as standard input and return a tuple
+    of the exit status and the octets written to standard output and
+    standard error.
+
+    """
+    stdout, stderr = io.BytesIO(), io.BytesIO()
+    streams = sys.stdin, sys.stdout, sys.stderr
+    try:
+        if isinstance(stdin, bytes):
+            stdin = io.BytesIO(stdin)
+        sys.stdin = io.TextIOWrapper(stdin)
+        sys.stdout = io.TextIOWrapper(stdout, write_through=True)
+        sys.stderr = io.TextIOWrapper(stderr, write_through=True)
+        status = run_pipeline(args)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        return status, stdout.getvalue(), stderr.getvalue()
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = streams
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import shlex
+import multiprocessing
+import click
+
+from ndeftool.cli import command_processor, run_pipeline, call_pipeline
+from ndeftool.cli import dmsg, info, warn
+from ndeftool import daemon
+
+
+@click.command(short_help="Run pipelines from a batch file.")
+@click.argument('file', type=click.File('r', lazy=True))
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1,
+              metavar='N', help="Run pipelines in N worker processes.")
+@command_processor
+def cmd(message, **kwargs):
+    """The *batch* command runs each line of FILE as a separate ndeftool
+    command line within the current process. A line holds the global
+    options and commands that would follow 'ndeftool' in the shell and
+    is split into arguments with shell quoting rules. Empty lines and
+    comments that start with '#' are skipped. A single '-' reads the
+    lines from standard input.
+
+    Each line starts a new pipeline with fresh global options. Records
+    not consumed by the last command of a line are written to standard
+    output. An error is reported with the line number and does not
+    stop the batch, the batch command fails at the end if any line
+    failed.
+
+    With '--jobs' the pipelines are distributed to N worker processes
+    that each load the ndeftool commands and libmagic only once. The
+    standard output and standard error of each pipeline is collected
+    and written in the order of the batch file lines. Pipelines that
+    run in parallel must not write to the same files and can not read
+    from standard input.
+
+    \b
+    Examples:
+      echo "text 'one' id r1 save 1.ndef" > make.batch
+      echo "text 'two' id r2 save 2.ndef" >> make.batch
+      ndeftool batch make.batch
+      ndeftool --silent batch - < make.batch
+      ndeftool batch --jobs 8 make.batch
+
+    """
+    dmsg(__name__ + ' ' + str(kwargs))
+
+    jobs = read_batch(kwargs['file'])
+    if kwargs['jobs'] > 1:
+        results = run_parallel(jobs, kwargs['jobs'])
+    else:
+        results = run_serial(jobs)
+
+    failed = total = 0
+    for lineno, status, errmsg in results:
+        if status != 0:
+            warn("line %d: %s" % (lineno, errmsg or "exit status %d" % status))
+            failed = failed + 1
+        else:
+            dmsg("line %d: exit status 0" % lineno)
+        total = total + 1
+
+    info("Finished {num} pipeline{s}, {failed} failed.".format(
+        num=total, failed=failed, s=('', 's')[total != 1]))
+
+    if failed:
+        errmsg = "%d of %d pipelines failed" % (failed, total)
+        raise click.ClickException(errmsg)
+
+    return message if message is not None else []
+
+
+def read_batch(f):
+    # Yields (lineno, args, errmsg) for each non-empty line, with
+    # args set to None if the line could not be split.
+    for lineno, line in enumerate(f, start=1):
+        try:
+            args = shlex.split(line, comments=True)
+        except ValueError as error:
+            yield lineno, None, str(error)
+        else:
+            if args:
+                yield lineno, args, None
+
+
+def run_serial(jobs):
+    for lineno, args, errmsg in jobs:
+        if args is None:
+            yield lineno, 1, errmsg
+        else:
+            yield lineno, run_pipeline(args), None
+
+
+def run_parallel(jobs, processes):
+    stdout = click.get_binary_stream('stdout')
+    stderr = click.get_binary_stream('stderr')
+    pool = multiprocessing.Pool(processes, initializer=daemon.warm_up)
+    try:
+        for lineno, status, errmsg, out, err in pool.imap(call_job, jobs, 16):
+            stdout.write(out)
+            stdout.flush()
+            stderr.write(err)
+            stderr.flush()
+            yield lineno, status, errmsg
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def call_job(job):
+    # An exception must not leave the worker, pool.imap() would raise
+    # it in the batch and lose the results of the remaining lines.
+    lineno, args, errmsg = job
+    if args is None:
+        return lineno, 1, errmsg, b'', b''
+    try:
+        status, out, err = call_pipeline(args)
+    except Exception as error:
+        return lineno, 1, str(error), b'', b''
+    return lineno, status, None, out, err
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import click
+
+from ndeftool.cli import command_processor, open_cache, dmsg, info, echo
+
+STATS_FORMAT = "{:10} {:>10} {:>12} {:>12} {:>12}"
+
+
+@click.command(short_help="Show or clear the persistent caches.")
+@click.argument('action', type=click.Choice(['stats', 'clear']))
+@click.option('-t', '--table', multiple=True, metavar='NAME',
+              help="Clear only the cache table NAME.")
+@command_processor
+@click.pass_context
+def cmd(ctx, message, **kwargs):
+    """The *cache* command shows the number of entries and value octets
+    of each table in the persistent cache, or removes all entries of
+    the tables given with '--table' or of all tables. The cache
+    directory is set with the '--cache-dir' option or the
+    NDEFTOOL_CACHE_DIR environment variable.
+
+    The 'mimetype' table holds the mimetypes discovered by libmagic,
+    the 'digest' table the content hashes of loaded files and the
+    'decode' table the record layouts of decoded files. The 'decode'
+    table is bounded by the number of entries and value octets, the
+    others by the number of entries, and the least recently used
+    entries are removed first.
+
+    The *cache* command does not change the current records.
+
+    \b
+    Examples:
+      ndeftool --cache-dir ~/.cache/ndeftool cache stats
+      NDEFTOOL_CACHE_DIR=/tmp/ndef ndeftool cache --table decode clear
+
+    """
+    dmsg(__name__ + ' ' + str(kwargs))
+
+    from ndeftool.cache import TABLES, OCTETS, CacheError
+
+    for table in kwargs['table']:
+        if table not in TABLES:
+            errmsg = "unknown cache table '%s'." % table
+            raise click.ClickException(errmsg)
+
+    cache = open_cache()
+    if cache is None:
+        errmsg = "no cache directory, use '--cache-dir' or NDEFTOOL_CACHE_DIR."
+        raise click.ClickException(errmsg)
+
+    try:
+        if kwargs['action'] == 'clear':
+            cache.clear(kwargs['table'])
+            info("Cleared %s in %s" % (', '.join(
+                kwargs['table'] or sorted(TABLES)), cache.path))
+        else:
+            echo(STATS_FORMAT.format(
+                'table', 'entries', 'octets', 'max-entries', 'max-octets'))
+            for table, entries, octets in cache.stats():
+                echo(STATS_FORMAT.format(table, entries, octets, TABLES[
+                    table], OCTETS.get(table, '-')))
+    except CacheError as error:
+        raise click.ClickException(str(error))
+
+    return message if message is not None else []
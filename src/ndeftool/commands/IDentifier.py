@@ -8,7 +8,7 @@ from ndeftool.cli import command_processor, dmsg
 
 @click.command(short_help="Change the identifier of the last record.")
 @click.argument('name')
-@command_processor
+@command_processor(buffered=True)
 def cmd(message, **kwargs):
     """The *identifier* command either changes the current last record's
     name (NDEF Record ID) or, if the current message does not have any
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import click
+
+from ndeftool.cli import command_processor, dmsg, info
+from ndeftool.scan import ScanError
+from ndeftool import index
+
+
+@click.command(short_help="Write a record index for an NDEF file.")
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('-o', '--output', type=click.Path(writable=True),
+              metavar='FILE', help="Write the index to FILE.")
+@command_processor
+@click.pass_context
+def cmd(ctx, message, **kwargs):
+    """The *index* command writes a sidecar index for the NDEF file PATH
+    to PATH.idx or the file given with '--output'. The index holds the
+    offset, header flags and TYPE, ID and PAYLOAD length of each
+    record and the first record of each message. It is found by
+    scanning the record headers, payloads are skipped and not decoded.
+
+    With an up to date index *load* selects records with '--skip',
+    '--count', '--head' and '--tail' by seeking directly to the first
+    selected record, which makes a small selection from a large file
+    independent of its position. An index that does not match the
+    size and modification time of PATH is ignored. The *load* command
+    only looks for the index at PATH.idx.
+
+    The *index* command does not change the current records.
+
+    \b
+    Examples:
+      ndeftool index capture.ndef
+      ndeftool index capture.ndef load --skip 2000000 capture.ndef print
+
+    """
+    dmsg(__name__ + ' ' + str(kwargs))
+
+    try:
+        records, messages = index.write_index(kwargs['path'],
+                                              kwargs['output'])
+    except (OSError, IOError) as error:
+        raise click.ClickException(str(error))
+    except ScanError as error:
+        errmsg = "%s is not a valid NDEF file: %s" % (kwargs['path'], error)
+        raise click.ClickException(errmsg)
+
+    info("Indexed %d record(s) in %d message(s) of %s" % (
+        records, messages, kwargs['path']))
+
+    return message if message is not None else []
@@ -1,17 +1,58 @@
 # -*- coding: utf-8 -*-
 
+import io
+import os
+import re
+import sys
+import mmap
 import click
-import magic
 import glob
+import fnmatch
+import functools
 import ndef
+import threading
+import itertools
+import collections
 
-from ndeftool.cli import command_processor, info, warn, dmsg
+from ndeftool.cli import command_processor, extend, counted, open_cache
+from ndeftool.cli import select_range
+from ndeftool.cli import dmsg, info, warn
+from ndeftool.records import FileRecord
+from ndeftool.scan import ScanError, scan_headers
+from ndeftool import mimetype, index
 
 
 @click.command(short_help="Load records or payloads from disk.")
 @click.argument('path', type=click.Path())
 @click.option('-p', '--pack', is_flag=True,
               help="Pack files as payload into mimetype records.")
+@click.option('--lazy', is_flag=True,
+              help="Read packed files only when records are written.")
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1,
+              metavar='N', help="Read up to N files concurrently.")
+@click.option('--max-inflight', type=click.IntRange(min=1),
+              default=64 << 20, metavar='N',
+              help="Read ahead at most N octets with --jobs.")
+@click.option('-r', '--recursive', is_flag=True,
+              help="Load all files below the directory PATH.")
+@click.option('--include', multiple=True, metavar='PATTERN',
+              help="Load only files that match PATTERN.")
+@click.option('--exclude', multiple=True, metavar='PATTERN',
+              help="Skip files and directories that match PATTERN.")
+@click.option('--sort', is_flag=True,
+              help="Visit directory entries in sorted order.")
+@click.option('-a', '--archive', is_flag=True,
+              help="Load the members of zip or tar archive files.")
+@click.option('-w', '--watch', is_flag=True,
+              help="Run the pipeline again when the files change.")
+@click.option('--skip', type=click.IntRange(min=0), default=0,
+              metavar='N', help="Skip the first N records of each file.")
+@click.option('--count', type=click.IntRange(min=1), default=None,
+              metavar='N', help="Load at most N records of each file.")
+@click.option('--head', type=click.IntRange(min=1), default=None,
+              metavar='N', help="Load the first N selected records.")
+@click.option('--tail', type=click.IntRange(min=1), default=None,
+              metavar='N', help="Load the last N selected records.")
 @command_processor
 @click.pass_context
 def cmd(ctx, message, **kwargs):
@@ -27,7 +68,46 @@ def cmd(ctx, message, **kwargs):
     records. In '--pack' mode the files are loaded into the payload of
     NDEF records with record type (NDEF Record TNF and TYPE) set to
     the mimetype discovered from the payload and record name (NDEF
-    Record ID) set to the filename.
+    Record ID) set to the filename. With '--lazy' a packed regular
+    file is only examined for the mimetype and its content is read
+    when the record is encoded or saved, so that a pipeline that packs
+    many large files holds at most one payload in memory.
+
+    With '--jobs' the files selected by PATH are opened and read by N
+    threads ahead of decoding, which helps when the latency of opening
+    a file dominates, for example with many small files on network
+    storage. The records are still produced in the sorted order of
+    file names. At most '--max-inflight' octets of file data are read
+    ahead, a single larger file is read when nothing else is pending.
+
+    With '--recursive' PATH is a directory and all files below it are
+    loaded as they are found, without first listing the whole tree.
+    Patterns given with '--include' and '--exclude' are matched
+    against the name and the path relative to PATH, an excluded
+    directory is not entered. The directory entries are visited in
+    the order returned by the file system, or sorted by name within
+    each directory with '--sort'.
+
+    With '--archive' each file is read as a zip or tar archive (tar
+    may be compressed with gzip, bzip2 or xz) and the regular file
+    members are loaded in archive order as if they were separate
+    files, without extracting them to disk. A tar archive is read
+    sequentially and can also be read from standard input, a zip
+    archive must be a seekable file.
+
+    The records loaded from each file can be restricted to the subset
+    selected with '--skip', '--count', '--head' and '--tail' applied
+    in that order. For a regular file only the selected records are
+    decoded. Their position is found with the sidecar index written by
+    the *index* command if that is present and up to date, otherwise
+    by a scan of the record headers that skips over the payloads.
+
+    With '--watch' the pipeline runs again whenever a file selected
+    by PATH is created, changed or removed, until it is interrupted.
+    The records of files that did not change are kept from the last
+    run, only changed files are loaded again. On Linux the directories
+    are watched with inotify, elsewhere the files are examined every
+    second.
 
     \b
     Examples:
@@ -36,49 +116,523 @@ def cmd(ctx, message, **kwargs):
       cat message.ndef | ndeftool load - print
       ndeftool load --pack /etc/hostname print
       ndeftool load --pack '/etc/cron.daily/*' print
+      ndeftool load --jobs 16 'tags/*.ndef' save all.ndef
+      ndeftool load -r --pack --include '*.png' --exclude .git assets print
+      ndeftool load --archive --pack assets.zip save assets.ndef
+      cat bundle.tar.gz | ndeftool load --archive - print
+      ndeftool load --skip 2000000 --count 10 capture.ndef print
+      ndeftool load --watch --pack 'assets/*' save --force assets.ndef
 
     """
     dmsg(__name__ + ' ' + str(kwargs))
 
-    if message is None:
-        message = []
+    if kwargs['watch'] and kwargs['path'] == '-':
+        raise click.ClickException("standard input can not be watched.")
+
+    if kwargs['recursive']:
+        if not os.path.isdir(kwargs['path']):
+            errmsg = "path '%s' is not a directory." % kwargs['path']
+            raise click.ClickException(errmsg)
+        selection = functools.partial(
+            walk_files, kwargs['path'], compile_patterns(kwargs['include']),
+            compile_patterns(kwargs['exclude']), kwargs['sort'])
+        directories = [kwargs['path']]
+    elif kwargs['path'] != '-':
+        selection = functools.partial(select_paths, kwargs['path'])
+        directory = os.path.dirname(kwargs['path']) or os.curdir
+        directories = [] if glob.has_magic(directory) else [directory]
 
     if kwargs['path'] == '-':
         filenames = kwargs['path']
+    elif kwargs['watch']:
+        filenames = open_watcher(ctx).watch(selection, directories)
+    else:
+        filenames = selection()
+    if kwargs['path'] != '-' and not kwargs['recursive']:
+        if len(filenames) == 0:
+            info("No files selected by path '%s'." % kwargs['path'])
+
+    errors = ctx.meta['decode-errors']
+    select = (kwargs['skip'], kwargs['count'], kwargs['head'], kwargs['tail'])
+    if select == (0, None, None, None):
+        select = None
+    if kwargs['archive']:
+        load = functools.partial(load_archives, pack=kwargs['pack'],
+                                 decode_errors=errors, select=select)
+    elif kwargs['jobs'] > 1 and kwargs['path'] != '-' and not (
+            kwargs['lazy'] or kwargs['watch']):
+        load = functools.partial(prefetch_files, pack=kwargs['pack'],
+                                 decode_errors=errors, jobs=kwargs['jobs'],
+                                 limit=kwargs['max_inflight'], select=select)
+    else:
+        load = functools.partial(load_files, pack=kwargs['pack'],
+                                 decode_errors=errors, lazy=kwargs['lazy'],
+                                 select=select)
+    if kwargs['watch']:
+        options = (errors, ctx.meta['mimetype-detect'], kwargs['pack'],
+                   kwargs['lazy'], kwargs['archive'], select)
+        records = watch_files(open_watcher(ctx), filenames, options, load)
     else:
-        filenames = sorted(glob.iglob(kwargs['path']))
+        records = load(filenames)
+    return extend(message, records)
+
+
+def select_paths(pattern):
+    return sorted(glob.iglob(pattern))
 
-    if len(filenames) == 0:
-        info("No files selected by path '%s'." % kwargs['path'])
 
+def open_watcher(ctx):
+    """Return the watcher that the pipeline waits on after it has run,
+    created by the first load --watch.
+
+    """
+    if ctx.meta.get('load-watch') is None:
+        from ndeftool.watch import Watcher
+        ctx.meta['load-watch'] = Watcher()
+    return ctx.meta['load-watch']
+
+
+def watch_files(watcher, filenames, options, load):
+    for filename in filenames:
+        for record in watcher.load(filename, options,
+                                   functools.partial(load, [filename])):
+            yield record
+
+
+def compile_patterns(patterns):
+    if patterns:
+        return re.compile('|'.join(fnmatch.translate(p) for p in patterns))
+
+
+def walk_files(top, include, exclude, ordered, prefix=''):
+    """Yield the paths of all files below the directory top, depth first.
+    Each directory entry is examined once with the file type that
+    os.scandir() returns. Symbolic links to directories are not
+    followed.
+
+    """
+    try:
+        scanner = os.scandir(top)
+    except OSError as error:
+        warn(str(error))
+        return
+    with scanner:
+        entries = scanner
+        if ordered:
+            entries = sorted(scanner, key=lambda entry: entry.name)
+        for entry in entries:
+            relpath = prefix + entry.name
+            if exclude and (exclude.match(entry.name) or
+                            exclude.match(relpath)):
+                continue
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                is_file = not is_dir and entry.is_file()
+            except OSError as error:
+                warn(str(error))
+                continue
+            if is_dir:
+                for path in walk_files(entry.path, include, exclude,
+                                       ordered, relpath + '/'):
+                    yield path
+            elif is_file and (include is None or include.match(entry.name)
+                              or include.match(relpath)):
+                yield entry.path
+
+
+def load_files(filenames, pack, decode_errors, lazy=False, select=None):
     for filename in filenames:
         try:
             f = click.open_file(filename, 'rb')
         except (OSError, IOError) as error:
             warn(str(error))
         else:
-            if kwargs['pack']:
-                message.append(pack_file(f))
-            else:
-                message.extend(load_file(f, ctx.meta['decode-errors']))
+            with f:
+                if pack:
+                    yield pack_file(f, lazy)
+                else:
+                    for record in load_file(f, decode_errors, select):
+                        yield record
 
-    return message
 
+def load_archives(filenames, pack, decode_errors, select=None):
+    import tarfile
+    import zipfile
+    for filename in filenames:
+        try:
+            f = click.open_file(filename, 'rb')
+        except (OSError, IOError) as error:
+            warn(str(error))
+            continue
+        fn = getattr(f, 'name', '<stdin>')
+        with f:
+            try:
+                for name, member in read_archive(f, fn):
+                    if pack:
+                        yield pack_data(member.read(), name)
+                    else:
+                        for record in decode_file(member, fn + ':' + name,
+                                                  decode_errors, select):
+                            yield record
+            except (tarfile.TarError, zipfile.BadZipfile, EOFError,
+                    OSError) as error:
+                errmsg = "%s: %s" % (fn, error)
+                raise click.ClickException(errmsg)
+
+
+def read_archive(f, fn):
+    """Yield (name, file) for each regular file member of the zip or tar
+    archive f. A member file must be read before the next is yielded.
+
+    """
+    import tarfile
+    import zipfile
+    if not isinstance(f, io.IOBase):
+        f = click.get_binary_stream('stdin')
+    if f.seekable() and zipfile.is_zipfile(f):
+        f.seek(0)
+        with zipfile.ZipFile(f) as archive:
+            for member in archive.infolist():
+                if not member.filename.endswith('/'):
+                    with archive.open(member) as member_file:
+                        yield member.filename, member_file
+        return
+    if f.seekable():
+        f.seek(0)
+    try:
+        archive = tarfile.open(fileobj=f, mode='r|*')
+    except tarfile.TarError:
+        errmsg = "%s is not a zip or tar archive." % fn
+        raise click.ClickException(errmsg)
+    with archive:
+        for member in archive:
+            if member.isfile():
+                yield member.name, archive.extractfile(member)
+
+
+def prefetch_files(filenames, pack, decode_errors, jobs, limit,
+                   select=None):
+    for filename, data, file_stat in read_files(filenames, jobs, limit):
+        if isinstance(data, Exception):
+            warn(str(data))
+        elif pack:
+            yield pack_data(data, filename, file_stat)
+        else:
+            for record in decode_file(io.BytesIO(data), filename,
+                                      decode_errors, select):
+                yield record
+
+
+def read_files(filenames, jobs, limit):
+    """Yield (filename, data, stat) tuples in the order of filenames, where
+    data is the file content or the error from reading the file and
+    stat is the file status if it is a regular file. Up to jobs
+    threads read ahead while the data not yet consumed stays within
+    limit octets. The data of a file is consumed when the next tuple is
+    requested.
+
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    budget = ReadBudget(limit)
+    executor = ThreadPoolExecutor(jobs)
+    tickets = enumerate(filenames)
+    pending = collections.deque()
+
+    def submit(count):
+        for ticket, filename in itertools.islice(tickets, count):
+            future = executor.submit(read_file, filename, ticket, budget)
+            pending.append((filename, future))
+
+    try:
+        submit(4 * jobs)
+        while pending:
+            filename, future = pending.popleft()
+            data, file_stat, held = future.result()
+            yield filename, data, file_stat
+            budget.release(held)
+            submit(1)
+    finally:
+        budget.close()
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown()
+
+
+def read_file(filename, ticket, budget):
+    held = None
+    try:
+        with open(filename, 'rb') as f:
+            file_stat = mimetype.file_stat(f)
+            size = file_stat.st_size if file_stat else 0
+            held = budget.acquire(ticket, size)
+            return f.read(), file_stat, held
+    except (OSError, IOError) as error:
+        if held is None:
+            held = budget.acquire(ticket, 0)
+        return error, None, held
+
+
+class ReadBudget(object):
+    """Admit file reads in ticket order while the octets held stay within
+    limit. A read larger than limit is admitted when nothing is held.
+    Admission in ticket order guarantees that the next file to consume
+    is never blocked by files that are read ahead of it.
+
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.held = 0
+        self.turn = 0
+        self.closed = False
+        self.condition = threading.Condition()
 
-def pack_file(f):
-    record_data = f.read()
-    record_type = magic.from_buffer(record_data, mime=1)
-    record_name = getattr(f, 'name', '<stdin>')[0:255]
-    return ndef.Record(record_type, record_name, record_data)
+    def acquire(self, ticket, size):
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed or (
+                self.turn == ticket and
+                (self.held == 0 or self.held + size <= self.limit)))
+            if self.closed:
+                return 0
+            self.held += size
+            self.turn += 1
+            self.condition.notify_all()
+            return size
 
+    def release(self, size):
+        with self.condition:
+            self.held -= size
+            self.condition.notify_all()
 
-def load_file(f, decode_errors):
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+def pack_file(f, lazy=False):
+    mapping = map_file(f)
+    if mapping is None:
+        record_data = f.read()
+    else:
+        record_data = memoryview(mapping)
+    try:
+        record_name = getattr(f, 'name', '<stdin>')
+        file_stat = mimetype.file_stat(f)
+        if lazy and mapping is not None:
+            # Mimetype detection only touches the leading octets.
+            record_type = detect_mimetype(record_data, record_name, file_stat)
+            return FileRecord(record_type, record_name[0:255],
+                              os.path.abspath(f.name), len(mapping))
+        return pack_data(record_data, record_name, file_stat)
+    finally:
+        if mapping is not None:
+            record_data.release()
+            mapping.close()
+
+
+def pack_data(record_data, record_name, file_stat=None):
+    record_type = detect_mimetype(record_data, record_name, file_stat)
+    return ndef.Record(record_type, record_name[0:255], record_data)
+
+
+def detect_mimetype(record_data, record_name, file_stat):
+    strategy = click.get_current_context().meta['mimetype-detect']
+    return mimetype.from_buffer(record_data, open_cache(), file_stat,
+                                record_name, strategy)
+
+
+def load_file(f, decode_errors, select=None):
     fn = getattr(f, 'name', '<stdin>')
+    mapping = map_file(f)
+    if mapping is not None:
+        if select is not None:
+            return load_range(f, fn, mapping, decode_errors, select)
+        cache = open_cache()
+        if cache is not None:
+            return load_cached(f, fn, mapping, decode_errors, cache)
+        f = MappedReader(mapping)
+    elif not isinstance(f, io.IOBase):
+        # Standard input opened by click.open_file('-') is a proxy
+        # object that ndef.message_decoder() does not accept.
+        f = click.get_binary_stream('stdin')
+    return load_mapped(f, fn, mapping, decode_errors, select)
+
+
+def load_mapped(f, fn, mapping, decode_errors, select):
+    try:
+        for record in decode_file(f, fn, decode_errors, select):
+            yield record
+    finally:
+        if mapping is not None:
+            mapping.close()
+
+
+def load_cached(f, fn, mapping, decode_errors, cache):
+    """Build the records of the memory mapped file f from the record
+    layout in the decode cache, or decode them and store the layout
+    when all records were decoded.
+
+    """
+    from ndeftool import layout
+    try:
+        key = layout.layout_key(cache, mapping, os.fstat(f.fileno()),
+                                decode_errors)
+        octets = cache.get('decode', key)
+        if octets is not None:
+            dmsg("%s: record layout found in decode cache" % fn)
+            count = 0
+            for record in layout.build_records(mapping, octets,
+                                               decode_errors):
+                count = count + 1
+                yield record
+            info("loaded %d record(s) from %s" % (count, fn))
+            return
+        count = 0
+        for record in decode_file(MappedReader(mapping), fn, decode_errors):
+            count = count + 1
+            yield record
+        mapping.seek(0)
+        headers = scan_headers(MappedReader(mapping))
+        cache.put('decode', key, layout.pack_layout(
+            itertools.islice(headers, count)))
+    finally:
+        mapping.close()
+
+
+def load_range(f, fn, mapping, decode_errors, select):
+    """Decode only the selected records of the first message in the
+    memory mapped file f. The record offsets are read from the index
+    file if that matches f, otherwise found by a header scan.
+
+    """
+    file_stat = os.fstat(f.fileno())
+    try:
+        records = index.Index(f.name + index.SUFFIX, file_stat)
+    except index.IndexFileError as error:
+        dmsg("%s: %s" % (f.name + index.SUFFIX, error))
+        try:
+            records = index.MessageScan(f)
+        except ScanError as error:
+            mapping.close()
+            dmsg(str(error))
+            errmsg = "%s does not contain a valid NDEF message." % fn
+            raise click.ClickException(errmsg)
+    try:
+        first, length = records.message(0)
+        skip, number = select_range(length, *select)
+        if number == 0:
+            return load_mapped(io.BytesIO(b''), fn, mapping,
+                               decode_errors, None)
+        dmsg("%s: records %d to %d of %d" % (fn, skip, skip + number - 1,
+                                             length))
+        if records.chunked(first + skip, first + skip + number - 1):
+            # The range can not be a message of its own if it divides
+            # a chunk sequence, all records are decoded and selected.
+            dmsg("%s: selected records divide a chunk sequence" % fn)
+            return load_mapped(MappedReader(mapping), fn, mapping,
+                               decode_errors, select)
+        bounds = records.bounds(first + skip, first + skip + number - 1)
+    finally:
+        records.close()
+    return load_mapped(RangeReader(mapping, *bounds), fn, mapping,
+                       decode_errors, None)
+
+
+def select_records(records, skip, count, head, tail):
+    # The records of select_range() from an iterable of unknown length.
+    limit = min(count or sys.maxsize, head or sys.maxsize)
+    records = itertools.islice(records, skip, skip + limit
+                               if limit < sys.maxsize else None)
+    if tail is not None:
+        # The tail can only be found after all records are seen.
+        records = collections.deque(records, maxlen=tail)
+    return records
+
+
+def decode_file(f, fn, decode_errors, select=None):
+    records = decode_records(f, fn, decode_errors)
+    if select is not None:
+        records = select_records(records, *select)
+    for record in records:
+        yield record
+
+
+def decode_records(f, fn, decode_errors):
     try:
-        records = list(ndef.message_decoder(f.read(), decode_errors))
-        info("loaded %d record(s) from %s" % (len(records), fn))
-        return records
+        count = 0
+        for record in ndef.message_decoder(counted(f), decode_errors):
+            count = count + 1
+            yield record
+        info("loaded %d record(s) from %s" % (count, fn))
     except ndef.DecodeError as error:
         dmsg(str(error))
         errmsg = "%s does not contain a valid NDEF message." % fn
         raise click.ClickException(errmsg)
+
+
+def map_file(f):
+    """Return a read only memory map of the regular file f, or None if
+    f is standard input, not a regular file or empty.
+
+    """
+    if isinstance(f, io.IOBase):
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError, io.UnsupportedOperation):
+            pass
+
+
+class MappedReader(io.RawIOBase):
+    """Serve the reads of ndef.message_decoder() from a memory map, so
+    that a large file is not read through the file buffer but copied
+    once from the page cache into each record.
+
+    """
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.mapping.seek(offset, whence)
+        return self.mapping.tell()
+
+    def tell(self):
+        return self.mapping.tell()
+
+    def read(self, size=-1):
+        return self.mapping.read(size if size >= 0 else None)
+
+    def readinto(self, buffer):
+        octets = self.mapping.read(len(buffer))
+        buffer[0:len(octets)] = octets
+        return len(octets)
+
+
+class RangeReader(io.RawIOBase):
+    """Serve the octets from start to end of a memory map as a complete
+    NDEF message. The MB flag is set in the record at start and the ME
+    flag in the record at last.
+
+    """
+    def __init__(self, mapping, start, last, end):
+        self.mapping = mapping
+        self.position = start
+        self.end = end
+        self.flags = ((start, 0x80), (last, 0x40))
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.end - self.position)
+        buffer[0:size] = self.mapping[self.position:self.position + size]
+        for offset, flag in self.flags:
+            if self.position <= offset < self.position + size:
+                buffer[offset - self.position] |= flag
+        self.position += size
+        return size
@@ -10,7 +10,7 @@ from ndeftool.cli import command_processor, dmsg
 @click.argument('data', type=click.UNPROCESSED)
 @click.option('-x', '--no-check', is_flag=True,
               help='Do not check decoding after data change.')
-@command_processor
+@command_processor(buffered=True)
 @click.pass_context
 def cmd(ctx, message, **kwargs):
     """The *payload* command either changes the current last record's
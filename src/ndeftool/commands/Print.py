@@ -3,13 +3,19 @@
 import click
 import ndef
 
-from ndeftool.cli import command_processor, dmsg, info, echo
+from ndeftool.cli import command_processor, decode_stdin, dmsg, info, echo
+from ndeftool.scan import ScanError, scan_message
+from ndeftool.records import FileRecord
 
 LONG_FORMAT = "  {:10} {}"
+SUMMARY_FORMAT = "{:>8} {:>3} {:24} {:16} {:>10}"
+SUMMARY_LINES = 1000
 
 
 @click.command(short_help="Print records as human readable.")
 @click.option('-l', '--long', is_flag=True, help="use a long print format")
+@click.option('-s', '--summary', is_flag=True,
+              help="print one line of record headers")
 @click.option('-k', '--keep', is_flag=True, help="keep message in pipeline")
 @command_processor
 @click.pass_context
@@ -22,6 +28,12 @@ def cmd(ctx, message, **kwargs):
     data is send to stdout or given to the next command. This can be
     changed with the '--keep' flag.
 
+    The '--summary' format is a table with one line per record that
+    shows the record number, TNF, type, name (NDEF Record ID) and
+    payload length. When given as the first command without '--keep'
+    the table is made from the record headers on standard input, the
+    payloads are skipped and not decoded.
+
     When given as the first command *print* attempts to decode an NDEF
     message from standard input and then process the generated list of
     records.
@@ -33,22 +45,42 @@ def cmd(ctx, message, **kwargs):
       ndeftool text one print --keep text two print
       ndeftool text 'print from stdin' | ndeftool print
       ndeftool text 'before' | ndeftool print text 'after' print
+      ndeftool print --summary < capture.ndef
 
     """
     dmsg(__name__ + ' ' + str(kwargs))
 
+    if kwargs['summary'] and kwargs['long']:
+        errmsg = "'--summary' can not be used with '--long'."
+        raise click.ClickException(errmsg)
+
+    if message is None and kwargs['summary'] and not kwargs['keep']:
+        info("Reading data from standard input")
+        print_headers(click.get_binary_stream('stdin'))
+        return []
+
     if message is None:
         info("Reading data from standard input")
-        octets = click.get_binary_stream('stdin').read()
-        errors = ctx.meta['decode-errors']
-        try:
-            message = list(ndef.message_decoder(octets, errors))
-        except ndef.DecodeError as error:
-            raise click.ClickException(str(error))
+        message = decode_stdin()
+
+    if kwargs['summary']:
+        records = print_summary(message)
+    else:
+        records = print_records(message, kwargs['long'])
+
+    if kwargs['keep']:
+        return records
+
+    for record in records:
+        pass
+    return []
 
+
+def print_records(message, long_format):
     for index, record in enumerate(message):
-        if not kwargs['long']:
+        if not long_format:
             echo(str(record))
+            yield record
             continue
 
         if isinstance(record, ndef.TextRecord):
@@ -73,5 +105,43 @@ def cmd(ctx, message, **kwargs):
             echo(LONG_FORMAT.format("type", record.type))
             echo(LONG_FORMAT.format("name", record.name))
             echo(LONG_FORMAT.format("data", bytes(record.data)))
+        yield record
+
+
+def print_headers(stream):
+    # The table lines are written in batches, because click.echo()
+    # costs as much as scanning the record header.
+    errors = click.get_current_context().meta['decode-errors']
+    lines = [SUMMARY_FORMAT.format('record', 'tnf', 'type', 'id', 'length')]
+    try:
+        for index, header in enumerate(scan_message(stream,
+                                                    errors == 'strict')):
+            lines.append(SUMMARY_FORMAT.format(
+                index+1, header.tnf,
+                ndef.Record._decode_type(header.tnf, header.type),
+                header.id.decode('latin'), header.payload_length))
+            if len(lines) == SUMMARY_LINES:
+                echo('\n'.join(lines))
+                lines = []
+    except ScanError as error:
+        raise click.ClickException(str(error))
+    finally:
+        if lines:
+            echo('\n'.join(lines))
+
+
+def print_summary(message):
+    echo(SUMMARY_FORMAT.format('record', 'tnf', 'type', 'id', 'length'))
+    for index, record in enumerate(message):
+        tnf = record._encode_type(record.type)[0]
+        echo(SUMMARY_FORMAT.format(
+            index+1, tnf, record.type, record.name,
+            payload_length(record) if tnf else 0))
+        yield record
+
 
-    return message if kwargs['keep'] else []
+def payload_length(record):
+    # The size of a file payload is known without reading the file.
+    if isinstance(record, FileRecord):
+        return record.size
+    return len(record.data)
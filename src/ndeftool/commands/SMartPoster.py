@@ -1,10 +1,10 @@
 # -*- coding: utf-8 -*-
 
-import magic
 import click
 import ndef
 
-from ndeftool.cli import command_processor, dmsg
+from ndeftool.cli import command_processor, extend, open_cache, dmsg
+from ndeftool import mimetype
 
 
 @click.command(short_help='Create an NFC Forum Smart Poster record.')
@@ -48,9 +48,6 @@ def cmd(message, **kwargs):
     """
     dmsg(__name__ + ' ' + str(kwargs))
 
-    if message is None:
-        message = []
-
     record = ndef.SmartposterRecord(kwargs['resource'])
     for lang, text in kwargs['titles']:
         record.set_title(text, lang)
@@ -58,14 +55,16 @@ def cmd(message, **kwargs):
         record.set_title(kwargs['title'], 'en')
     if kwargs['action']:
         record.action = kwargs['action']
+    strategy = click.get_current_context().meta['mimetype-detect']
     for icon_file in kwargs['icons']:
         icon_data = icon_file.read()
-        icon_type = magic.from_buffer(icon_data, mime=True)
+        icon_type = mimetype.from_buffer(
+            icon_data, open_cache(), mimetype.file_stat(icon_file),
+            icon_file.name, strategy)
         if icon_type.startswith('image/') or icon_type.startswith('video/'):
             record.add_icon(icon_type, icon_data)
         else:
             errmsg = "file %s is not a proper icon file" % icon_file.name
             raise click.ClickException(errmsg)
 
-    message.append(record)
-    return message
+    return extend(message, [record])
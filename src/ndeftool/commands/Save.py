@@ -1,11 +1,35 @@
 # -*- coding: utf-8 -*-
 
+import io
 import os.path
-import shutil
+import stat
+import sys
+import time
 import click
+import posixpath
 import ndef
+import collections
+import itertools
 
-from ndeftool.cli import command_processor, dmsg, info, warn
+from ndeftool.cli import command_processor, decode_stdin, tally, open_cache
+from ndeftool.cli import decode_message, dmsg, info, warn, select_range
+from ndeftool.scan import ScanError, scan_message
+
+# The data area octets of NFC Forum Type 2 Tag products.
+TAG_DATA_AREA = {
+    'ultralight': 48, 'ultralight-c': 144, 'ntag210': 48, 'ntag212': 128,
+    'ntag213': 144, 'ntag215': 504, 'ntag216': 888,
+}
+
+# The tar stream compression by file name extension.
+TAR_COMPRESSION = [
+    (('.tar.gz', '.tgz'), 'gz'),
+    (('.tar.bz2', '.tbz2'), 'bz2'),
+    (('.tar.xz', '.txz'), 'xz'),
+]
+
+# Numbers the temporary files of write_file() within the process.
+TEMPFILE_NUMBERS = itertools.count()
 
 
 @click.command(short_help="Save records or payloads to disk.")
@@ -24,8 +48,22 @@ from ndeftool.cli import command_processor, dmsg, info, warn
               help="Unpack records to files in directory.")
 @click.option('-f', '--force', is_flag=True,
               help="Replace existing file or directory.")
+@click.option('--sync', is_flag=True,
+              help="Update only changed files in directory.")
+@click.option('-a', '--archive', is_flag=True,
+              help="Write files into a zip or tar archive.")
+@click.option('-m', '--max-bytes', type=click.IntRange(min=1), default=None,
+              metavar='N', help="Pack records into messages of N octets.")
+@click.option('-t', '--tag', type=click.Choice(sorted(TAG_DATA_AREA)),
+              help="Pack records into messages for tag TYPE.")
 @click.option('-k', '--keep', is_flag=True,
               help="Forward records to next command.")
+@click.option('--raw', is_flag=True,
+              help="Copy records from standard input without decoding.")
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1,
+              metavar='N', help="Write up to N files concurrently.")
+@click.option('--fsync', type=click.Choice(['none', 'dir', 'file']),
+              default='none', help="Flush written data to disk.")
 @command_processor
 @click.pass_context
 def cmd(ctx, message, **kwargs):
@@ -42,82 +80,758 @@ def cmd(ctx, message, **kwargs):
     Records without name are not written unless '--unpack' and
     '--burst' are both set.
 
+    With '--max-bytes' the selected records are packed into as few
+    NDEF messages of at most N octets as possible, each written into a
+    separate file under directory PATH, named by three digit numbers
+    in the order of their first record. Records keep their order
+    within a message. The '--tag' option sets N to the NDEF message
+    capacity of a tag TYPE, that is the size of the tag data area
+    less the TLV octets needed to store the message. A record that
+    does not fit into N octets is an error.
+
     The *save* command does not replace existing files or directories
     unless this is requested with '--force'.
 
+    With '--jobs' the files of '--burst', '--unpack' and '--max-bytes'
+    mode are written by N threads, records are still encoded in
+    order. Files are opened relative to the open directory, so that
+    the directory path is not resolved again for each file. The
+    '--fsync' policy 'none' leaves writing to the operating system,
+    'dir' flushes the directory once at the end, so that the new file
+    names are durable, and 'file' also flushes each file before it is
+    closed.
+
+    With '--sync' an existing directory is updated in place instead
+    of being replaced, this also requires '--force'. A file is only
+    written if its size or content hash differs from the record,
+    through a temporary file that is renamed, and all files in the
+    directory not written by this run are removed. With
+    '--cache-dir' the content hash of an unchanged file is found by
+    its status instead of reading it again.
+
+    With '--archive' the files of '--burst', '--unpack' and
+    '--max-bytes' mode are written as members of a single archive
+    file PATH, instead of separate files in a directory. The archive
+    is a zip file if PATH ends with '.zip' and otherwise a tar file,
+    compressed if PATH ends with '.tar.gz', '.tar.bz2' or '.tar.xz'.
+    With PATH '-' a tar stream is written to standard output.
+
     The *save* command consumes records from the internal message
     pipe. This can be prevented with '--keep', all records are then
     forwarded to the next command or written to standard output. When
     *save* is the first command it creates the pipe by reading from
     standard input.
 
+    With '--raw' the first *save* command copies the selected records
+    of the message on standard input without decoding them. Only the
+    record headers are read to find the selected records, which are
+    then written unchanged, except that the MB and ME flags of the
+    first and last record are set. Payloads are not verified, and
+    records are not encoded again, so that the record encoding may
+    differ from the result without '--raw'.
+
     \b
     Examples:
       ndeftool text 'Hello World' save text.ndef
       ndeftool text 'Hello World' | ndeftool save text.ndef
       ndeftool text 'One' save one.ndef text 'Two' save two.ndef
+      ndeftool load big.ndef save --burst --jobs 8 --fsync dir records
+      ndeftool load big.ndef save --burst --archive records.tar.gz
+      ndeftool load urls.ndef save --tag ntag213 tags
+      ndeftool save --raw --skip 1000 --head 10 part.ndef < big.ndef
 
     """
     dmsg(__name__ + ' ' + str(kwargs))
 
     path = kwargs['path']
 
+    if kwargs['max_bytes'] and kwargs['tag']:
+        errmsg = "'--max-bytes' can not be used with '--tag'."
+        raise click.ClickException(errmsg)
+    max_bytes = kwargs['max_bytes']
+    if kwargs['tag']:
+        max_bytes = tag_capacity(TAG_DATA_AREA[kwargs['tag']])
+    if max_bytes:
+        for option in ('burst', 'unpack'):
+            if kwargs[option]:
+                errmsg = "'--%s' can not be used with '--%s'." % (
+                    option, 'tag' if kwargs['tag'] else 'max-bytes')
+                raise click.ClickException(errmsg)
+
+    for option in ('sync', 'archive'):
+        if kwargs[option] and not (kwargs['burst'] or kwargs['unpack'] or
+                                   max_bytes):
+            errmsg = "'--%s' requires '--burst', '--unpack' or " \
+                "'--max-bytes'." % option
+            raise click.ClickException(errmsg)
+    if kwargs['sync'] and kwargs['archive']:
+        errmsg = "'--sync' can not be used with '--archive'."
+        raise click.ClickException(errmsg)
+
+    if kwargs['raw']:
+        if message is not None:
+            errmsg = "'--raw' requires save to be the first command."
+            raise click.ClickException(errmsg)
+        for option in ('keep', 'burst', 'unpack', 'max_bytes', 'tag'):
+            if kwargs[option]:
+                option = option.replace('_', '-')
+                errmsg = "'--raw' can not be used with '--%s'." % option
+                raise click.ClickException(errmsg)
+
+    # An existing directory is updated with '--sync' and its other
+    # files removed, which is like replacing it and requires '--force'.
+    sync = kwargs['sync'] and os.path.isdir(path)
     if os.path.exists(path) and not kwargs['force']:
         errmsg = "path '%s' exists. Use '--force' to replace."
         raise click.ClickException(errmsg % path)
 
+    if message is None and kwargs['raw']:
+        info("Reading data from standard input")
+        writer = MessageWriter(path, kwargs['fsync'])
+        return save_raw(click.get_binary_stream('stdin'), kwargs, writer)
+
     if message is None:
         info("Reading data from standard input")
-        octets = click.get_binary_stream('stdin').read()
-        errors = ctx.meta['decode-errors']
+        message = decode_stdin()
+
+    if kwargs['tail'] is not None:
+        # The tail can only be found after all records are seen.
+        message = list(message)
+
+    if isinstance(message, list):
+        first, count = select_saved(len(message), kwargs)
+    else:
+        first = kwargs['skip']
+        count = min(kwargs['count'] or sys.maxsize,
+                    kwargs['head'] or sys.maxsize)
+        dmsg("first=%d count=%d" % (first, count))
+
+    if kwargs['archive']:
+        import tarfile
         try:
-            message = list(ndef.message_decoder(octets, errors))
-        except ndef.DecodeError as error:
+            writer = ArchiveWriter(path, kwargs['burst'], kwargs['unpack'])
+        except (OSError, IOError, tarfile.TarError) as error:
             raise click.ClickException(str(error))
+    elif kwargs['burst'] or kwargs['unpack'] or max_bytes:
+        path = os.path.normpath(path)
+        try:
+            if not sync:
+                if os.path.isdir(path):
+                    import shutil
+                    shutil.rmtree(path)
+                os.mkdir(path)
+        except (OSError, IOError) as error:
+            raise click.ClickException(str(error))
+        writer = DirectoryWriter(path, kwargs['burst'], kwargs['unpack'],
+                                 kwargs['jobs'], kwargs['fsync'],
+                                 kwargs['sync'])
+    else:
+        writer = MessageWriter(path, kwargs['fsync'])
 
-    first = min(kwargs['skip'], len(message))
-    count = min(kwargs['count'] or len(message), len(message))
-    head = min(kwargs['head'] or count, count)
-    tail = min(kwargs['tail'] or count, count)
-    dmsg("first=%d count=%d head=%d tail=%d" % (first, count, head, tail))
-    count = min(head, tail, len(message) - first)
-    first = first + head - min(head, tail)
-    dmsg("first=%d count=%d head=%d tail=%d" % (first, count, head, tail))
+    if max_bytes:
+        writer = ShardWriter(writer, max_bytes)
 
-    if kwargs['burst'] or kwargs['unpack']:
-        path = os.path.normpath(path)
+    return save_records(message, first, count, writer, kwargs['keep'])
+
+
+def select_saved(length, kwargs):
+    first, count = select_range(length, kwargs['skip'], kwargs['count'],
+                                kwargs['head'], kwargs['tail'])
+    dmsg("records %d to %d of %d" % (first, first + count - 1, length))
+    return first, count
+
+
+def save_raw(stream, kwargs, writer):
+    # Find the records of the first message on stream by their headers
+    # and copy the selected records to writer. A stream that can not
+    # seek is recorded while the headers are read. Without '--tail'
+    # reading stops after the last selected record.
+    if not stream.seekable():
+        stream = RecordingReader(stream)
+    limit = sys.maxsize
+    if kwargs['tail'] is None:
+        limit = kwargs['skip'] + min(kwargs['count'] or sys.maxsize,
+                                     kwargs['head'] or sys.maxsize)
+    strict = click.get_current_context().meta['decode-errors'] == 'strict'
+    try:
+        ranges = scan_ranges(stream, limit, strict)
+    except ScanError as error:
+        raise click.ClickException(str(error))
+    first, count = select_saved(len(ranges), kwargs)
+    if count and (first > 0 and ranges[first - 1][2] or
+                  ranges[first + count - 1][2]):
+        # The records can not be copied as a message of their own if
+        # they divide a chunk sequence, they are decoded and saved.
+        dmsg("selected records divide a chunk sequence")
+        stream.seek(ranges[0][0])
+        errors = click.get_current_context().meta['decode-errors']
+        message = decode_message(stream, errors)
+        for _ in save_records(message, first, count, writer, False):
+            pass
+        return []
+    try:
+        if count:
+            start, last = ranges[first][0], ranges[first + count - 1][0]
+            end = ranges[first + count - 1][1]
+            copy_records(stream, start, last, end, writer)
+            writer.count = count
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    return []
+
+
+def scan_ranges(stream, limit, strict):
+    # Return the start and end offset and the chunk flag of the records
+    # of the first message on stream, at most limit records.
+    ranges = []
+    for header in scan_message(stream, strict):
+        ranges.append((header.offset, header.offset + header.length,
+                       header.cf))
+        if len(ranges) == limit:
+            break
+    return ranges
+
+
+def copy_records(stream, start, last, end, writer):
+    # Copy the octets from start to end, with the MB flag set in the
+    # record at start and the ME flag set in the record at last.
+    stream.seek(start)
+    offset = start
+    while offset < end:
+        octets = bytearray(stream.read(min(end - offset, 1 << 20)))
+        if not octets:
+            raise click.ClickException("unexpected end of standard input")
+        if offset == start:
+            octets[0] = octets[0] & ~0x40 | 0x80
+        if offset <= last < offset + len(octets):
+            octets[last - offset] |= 0x40
+        writer.copy(octets)
+        offset += len(octets)
+
+
+def save_records(message, first, count, writer, keep):
+    # Write the selected records and yield all records that are
+    # forwarded to the next command. An error while records are
+    # streamed must not leave a partially written message file.
+    try:
+        for index, record in enumerate(message):
+            if first <= index < first + count:
+                writer.write(record)
+                if not keep:
+                    continue
+            yield record
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+
+class MessageWriter(object):
+    """Write records as one NDEF message into the file at path. Each
+    record is encoded when the next record or close() tells whether it
+    is the last record of the message. The file is opened with the
+    first record written, or by close() if there was none. Already
+    encoded records are written with copy(), the caller then sets the
+    number of records copied.
+
+    """
+    def __init__(self, path, fsync='none'):
+        self.path = path
+        self.fsync = fsync
+        self.file = None
+        self.encoder = ndef.message_encoder()
+        self.encoder.send(None)
+        self.count = 0
+        self.copied = 0
+
+    def write(self, record):
+        octets = self.encoder.send(record)
+        if self.file is None:
+            self.file = click.open_file(self.path, 'wb')
+        if octets:
+            self.file.write(octets)
+            tally('encoded', len(octets))
+        self.count = self.count + 1
+
+    def copy(self, octets):
+        if self.file is None:
+            self.file = click.open_file(self.path, 'wb')
+        self.file.write(octets)
+        tally('encoded', len(octets))
+        self.copied = self.copied + len(octets)
+
+    def close(self):
+        if self.file is None:
+            self.file = click.open_file(self.path, 'wb')
+        if self.count and not self.copied:
+            octets = self.encoder.send(None)
+            self.file.write(octets)
+            tally('encoded', len(octets))
+        filename = self.path if self.path != '-' else '<stdout>'
+        info("Saving {num} record{s} to {path}.".format(
+            num=self.count, path=filename, s=('', 's')[self.count > 1]))
+        if self.fsync != 'none' and self.path != '-':
+            self.file.flush()
+            if self.fsync == 'file':
+                os.fsync(self.file.fileno())
+            sync_directory(os.path.dirname(self.path) or os.curdir)
+        # Closing the click.open_file('-') proxy closes standard output.
+        if self.path != '-':
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def abort(self):
+        if self.file is not None and self.path != '-':
+            self.file.close()
+            os.remove(self.path)
+
+
+class DirectoryWriter(object):
+    """Write each record as a single record NDEF message (burst) or as
+    payload data (unpack) into a separate file under path. The files
+    are opened relative to a file descriptor of the directory, where
+    the platform supports that, and written by up to jobs threads.
+    Records are encoded by the caller's thread, the threads only open,
+    write, flush and close files.
+
+    With sync the files in path are only written if their content
+    differs, through a temporary file that replaces the file, and all
+    other files in path are removed by close().
+
+    """
+    def __init__(self, path, burst, unpack, jobs=1, fsync='none',
+                 sync=False):
+        self.path, self.burst, self.unpack = path, burst, unpack
+        self.fsync, self.sync = fsync, sync
+        self.index = 0
+        self.dir_fd = None
+        if os.open in os.supports_dir_fd:
+            flags = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0)
+            try:
+                self.dir_fd = os.open(path, flags)
+            except OSError as error:
+                raise click.ClickException(str(error))
+        self.executor = None
+        if jobs > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(jobs)
+        self.pending = collections.OrderedDict()
+        self.limit = 4 * jobs
+        self.names = set()
+        self.written = self.unchanged = 0
+        self.cache = open_cache() if sync else None
+
+    def write(self, record):
+        name, octets = record_file(record, self.index, self.burst,
+                                   self.unpack)
+        if name:
+            self.add(name, octets)
+        else:
+            warn("Skipping 1 record without name")
+        self.index = self.index + 1
+
+    def add(self, name, octets, count=1):
+        """Write the file name with octets that hold count records."""
+        name = os.path.normpath(name)
+        # A pending write of the same name must end before the file is
+        # compared or written again, the last record wins as in serial.
+        self.wait(name)
+        if self.sync:
+            self.names.add(name)
+            if self.is_unchanged(name, octets):
+                dmsg("Unchanged {}/{}".format(self.path, name))
+                self.unchanged = self.unchanged + 1
+                return
+        info("Saving {num} record{s} to {path}/{name}.".format(
+            num=count, s=('', 's')[count > 1], path=self.path, name=name))
+        self.submit(name, octets)
+        self.written = self.written + 1
+
+    def submit(self, name, octets):
+        path = name if self.dir_fd is not None else \
+            os.path.join(self.path, name)
+        args = (path, octets, self.dir_fd, self.fsync == 'file', self.sync)
+        if self.executor is None:
+            self.finish(lambda: write_file(*args))
+        else:
+            if len(self.pending) >= self.limit:
+                self.finish(self.pending.popitem(last=False)[1].result)
+            self.pending[name] = self.executor.submit(write_file, *args)
+
+    def wait(self, name):
+        future = self.pending.pop(name, None)
+        if future is not None:
+            self.finish(future.result)
+
+    def finish(self, result):
         try:
-            if os.path.isdir(path):
-                shutil.rmtree(path)
-            os.mkdir(path)
+            file_stat = result()
         except (OSError, IOError) as error:
             raise click.ClickException(str(error))
+        if self.cache is not None:
+            self.cache.put('digest', file_key(file_stat), file_stat.digest)
 
-        for index, record in enumerate(message[first:first+count]):
-            name = None
-            if kwargs['unpack'] and record.name:
-                name = record.name
-            if kwargs['burst'] and not name:
-                name = '%03d.ndef' % index
-            if name:
-                with click.open_file('%s/%s' % (path, name), 'wb') as f:
-                    info("Saving 1 record to {}.".format(f.name))
-                    if kwargs['unpack']:
-                        f.write(record.data)
-                    else:
-                        f.write(b''.join(ndef.message_encoder([record])))
+    def is_unchanged(self, name, octets):
+        """Return whether the file name has the content octets. The size
+        is compared first, the SHA-256 hash of the file is looked up in
+        the cache by its status or computed.
+
+        """
+        try:
+            file_stat = os.stat(name, dir_fd=self.dir_fd) \
+                if self.dir_fd is not None else \
+                os.stat(os.path.join(self.path, name))
+        except OSError:
+            return False
+        if not stat.S_ISREG(file_stat.st_mode):
+            return False
+        if file_stat.st_size != len(octets):
+            return False
+        digest = None
+        if self.cache is not None:
+            digest = self.cache.get('digest', file_key(file_stat))
+        if digest is None:
+            try:
+                digest = hash_file(name if self.dir_fd is not None else
+                                   os.path.join(self.path, name),
+                                   self.dir_fd)
+            except OSError:
+                return False
+            if self.cache is not None:
+                self.cache.put('digest', file_key(file_stat), digest)
+        import hashlib
+        return digest == hashlib.sha256(octets).hexdigest()
+
+    def close(self):
+        while self.pending:
+            self.finish(self.pending.popitem(last=False)[1].result)
+        if self.sync:
+            removed = self.remove_stale()
+            info("Synced {}: {} written, {} unchanged, {} removed.".format(
+                self.path, self.written, self.unchanged, removed))
+        if self.fsync != 'none':
+            try:
+                if self.dir_fd is not None:
+                    os.fsync(self.dir_fd)
+                else:
+                    sync_directory(self.path)
+            except (OSError, IOError) as error:
+                raise click.ClickException(str(error))
+        self.release()
+
+    def remove_stale(self):
+        """Remove all files below path that were not saved by this run,
+        and directories that are then empty. Return the number of files
+        removed.
+
+        """
+        removed = 0
+        for top, dirs, files in os.walk(self.path, topdown=False):
+            relative = os.path.relpath(top, self.path)
+            for filename in files:
+                name = os.path.normpath(os.path.join(relative, filename))
+                if name not in self.names:
+                    dmsg("Removing {}/{}".format(self.path, name))
+                    try:
+                        os.remove(os.path.join(top, filename))
+                        removed = removed + 1
+                    except OSError as error:
+                        warn(str(error))
+            if top != self.path and not os.listdir(top):
+                os.rmdir(top)
+        return removed
+
+    def abort(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.release()
+
+    def release(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.dir_fd is not None:
+            os.close(self.dir_fd)
+            self.dir_fd = None
+
+
+class ArchiveWriter(object):
+    """Write each record as a single record NDEF message (burst) or as
+    payload data (unpack) into a member of the zip or tar archive at
+    path, standard output if path is '-'. The archive format is
+    selected by the file name extension, standard output gets an
+    uncompressed tar stream. Archives are written sequentially, so
+    that standard output may be a pipe.
+
+    """
+    def __init__(self, path, burst, unpack):
+        import tarfile
+        import zipfile
+        self.path, self.burst, self.unpack = path, burst, unpack
+        self.index = self.count = 0
+        self.mtime = time.time()
+        if path == '-':
+            # click.open_file('-') returns a proxy object that tarfile
+            # does not accept.
+            self.file = click.get_binary_stream('stdout')
+        else:
+            self.file = open(path, 'wb')
+        try:
+            if path.lower().endswith('.zip'):
+                self.archive = zipfile.ZipFile(self.file, 'w',
+                                               zipfile.ZIP_DEFLATED)
             else:
-                warn("Skipping 1 record without name")
+                compression = [mode for suffixes, mode in TAR_COMPRESSION
+                               if path.lower().endswith(suffixes)]
+                self.archive = tarfile.open(
+                    fileobj=self.file, mode='w|' + ''.join(compression))
+        except BaseException:
+            self.abort()
+            raise
+
+    def write(self, record):
+        name, octets = record_file(record, self.index, self.burst,
+                                   self.unpack)
+        if name:
+            self.add(name, octets)
+        else:
+            warn("Skipping 1 record without name")
+        self.index = self.index + 1
+
+    def add(self, name, octets, count=1):
+        """Write the member name with octets that hold count records."""
+        import tarfile
+        import zipfile
+        name = posixpath.normpath(name)
+        info("Saving {num} record{s} to {path}:{name}.".format(
+            num=count, s=('', 's')[count > 1], path=self.path, name=name))
+        if isinstance(self.archive, zipfile.ZipFile):
+            member = zipfile.ZipInfo(name, time.localtime(self.mtime)[0:6])
+            member.external_attr = 0o644 << 16
+            member.compress_type = zipfile.ZIP_DEFLATED
+            self.archive.writestr(member, bytes(octets))
+        else:
+            member = tarfile.TarInfo(name)
+            member.size, member.mtime = len(octets), self.mtime
+            member.mode = 0o644
+            self.archive.addfile(member, io.BytesIO(octets))
+        self.count = self.count + count
+
+    def close(self):
+        self.archive.close()
+        info("Saving {num} record{s} to archive {path}.".format(
+            num=self.count, path=self.path, s=('', 's')[self.count != 1]))
+        if self.path != '-':
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def abort(self):
+        if self.path != '-':
+            self.file.close()
+            os.remove(self.path)
+
+
+class ShardWriter(object):
+    """Write the records as few NDEF messages of at most max_bytes octets
+    as possible, each into a file added to the DirectoryWriter or
+    ArchiveWriter files. Each record is encoded once, the messages are
+    composed from the encoded records by close().
+
+    """
+    def __init__(self, files, max_bytes):
+        self.files, self.max_bytes = files, max_bytes
+        self.records = []
+
+    def write(self, record):
+        octets = bytearray(b''.join(ndef.message_encoder([record])))
+        tally('encoded', len(octets))
+        if len(octets) > self.max_bytes:
+            errmsg = "record {} encodes to {} octets, more than {} octets."
+            raise click.ClickException(errmsg.format(
+                len(self.records), len(octets), self.max_bytes))
+        self.records.append(octets)
+
+    def close(self):
+        sizes = [len(octets) for octets in self.records]
+        for index, shard in enumerate(pack_records(sizes, self.max_bytes)):
+            octets = bytearray()
+            for position, record in enumerate(shard):
+                start = len(octets)
+                octets += self.records[record]
+                # The MB and ME flags are both set in a single record
+                # message and then cleared where the record is not
+                # first or last in this message.
+                if position > 0:
+                    octets[start] &= ~0x80
+                if position < len(shard) - 1:
+                    octets[start] &= ~0x40
+            self.files.add('%03d.ndef' % index, octets, len(shard))
+        self.files.close()
+
+    def abort(self):
+        self.files.abort()
+
+
+def pack_records(sizes, capacity):
+    """Return the record indices of each message when records of the
+    encoded sizes are packed into messages of at most capacity octets
+    by first fit decreasing. The records of a message are in input
+    order and messages are ordered by their first record.
+
+    """
+    # The free octets of each possible message are the leaves of a
+    # tree where each node holds the maximum of its children, so that
+    # the first message with enough free octets is found by descending
+    # from the root. Messages not yet used have all octets free.
+    leaves = 1
+    while leaves < len(sizes):
+        leaves = 2 * leaves
+    free = [capacity] * (2 * leaves)
+    shards = []
+    for index in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+        node = 1
+        while node < leaves:
+            node = 2 * node + (free[2 * node] < sizes[index])
+        if node - leaves == len(shards):
+            shards.append([])
+        shards[node - leaves].append(index)
+        free[node] -= sizes[index]
+        while node > 1:
+            node = node // 2
+            free[node] = max(free[2 * node], free[2 * node + 1])
+    return sorted(sorted(shard) for shard in shards)
+
+
+def tag_capacity(data_area):
+    # The NDEF message capacity of a Type 2 Tag data area that also
+    # holds the NDEF Message TLV header and the Terminator TLV.
+    return data_area - (2 if data_area - 3 < 255 else 4) - 1
+
+
+def record_file(record, index, burst, unpack):
+    """Return the file name and content of the record with index in
+    burst or unpack mode, or (None, None) if the record is not saved.
+    The name is a path below the directory or archive, as it was when
+    files were opened by '%s/%s' % (path, name).
+
+    """
+    name = None
+    if unpack and record.name:
+        name = record.name
+    if burst and not name:
+        name = '%03d.ndef' % index
+    if not name:
+        return None, None
+    if unpack:
+        octets = record.data
     else:
-        with click.open_file(path, 'wb') as f:
-            filename = f.name if f.name != '-' else '<stdout>'
+        octets = b''.join(ndef.message_encoder([record]))
+        tally('encoded', len(octets))
+    return name.lstrip('/'), octets
+
+
+class FileStat(object):
+    # The os.stat() fields of a file key with the file content hash.
+    def __init__(self, file_stat, digest):
+        self.__dict__.update((name, getattr(file_stat, name)) for name in (
+            'st_dev', 'st_ino', 'st_size', 'st_mtime_ns'))
+        self.digest = digest
+
+
+def write_file(name, octets, dir_fd=None, fsync=False, replace=False):
+    """Write octets to the file name, relative to dir_fd if not None,
+    and return a FileStat. With replace the octets are written to a
+    temporary file that is then renamed to name, so that the file is
+    never seen with partial content, and the content hash is added.
+
+    """
+    flags = (os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+             getattr(os, 'O_BINARY', 0) | getattr(os, 'O_CLOEXEC', 0))
+    target = name
+    if replace:
+        head, tail = os.path.split(name)
+        name = os.path.join(head, '.%s.%d.%d.tmp' % (
+            tail, os.getpid(), next(TEMPFILE_NUMBERS)))
+        flags = flags | os.O_EXCL
+    fd = os.open(name, flags, 0o666, dir_fd=dir_fd)
+    try:
+        try:
+            view = memoryview(octets)
+            while view:
+                view = view[os.write(fd, view):]
+            if fsync:
+                os.fsync(fd)
+            file_stat = os.fstat(fd)
+        finally:
+            os.close(fd)
+        if replace:
+            os.replace(name, target, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+    except BaseException:
+        if replace:
+            os.remove(name, dir_fd=dir_fd)
+        raise
+    digest = None
+    if replace:
+        import hashlib
+        digest = hashlib.sha256(octets).hexdigest()
+    return FileStat(file_stat, digest)
+
+
+def hash_file(name, dir_fd=None):
+    fd = os.open(name, os.O_RDONLY | getattr(os, 'O_BINARY', 0),
+                 dir_fd=dir_fd)
+    import hashlib
+    with os.fdopen(fd, 'rb') as f:
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_key(file_stat):
+    # The cache module is only imported when a cache is used.
+    from ndeftool.cache import stat_key
+    return stat_key(file_stat)
+
+
+def sync_directory(path):
+    # Directories can not be opened and flushed on all platforms.
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class RecordingReader(io.RawIOBase):
+    """Read from a binary stream that can not seek and keep the octets
+    read, so that the stream can be read again from any offset.
+
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.octets = bytearray()
+        self.offset = 0
 
-            info("Saving {num} record{s} to {path}.".format(
-                num=count, path=filename, s=('', 's')[count > 1]))
+    def readable(self):
+        return True
 
-            f.write(b''.join(ndef.message_encoder(message[first:first+count])))
+    def seekable(self):
+        return False
 
-    if not kwargs['keep']:
-        del message[first:first+count]
+    def readinto(self, buffer):
+        missing = self.offset + len(buffer) - len(self.octets)
+        if missing > 0:
+            self.octets.extend(self.stream.read(missing))
+        octets = self.octets[self.offset:self.offset + len(buffer)]
+        buffer[0:len(octets)] = octets
+        self.offset += len(octets)
+        return len(octets)
 
-    return message
+    def seek(self, offset):
+        self.offset = offset
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import os
+import click
+
+from ndeftool.cli import command_processor, dmsg, info
+from ndeftool import daemon
+
+
+@click.command(short_help="Serve pipelines over a Unix domain socket.")
+@click.option('-S', '--socket', 'path', required=True, type=click.Path(),
+              help="Path name of the Unix domain socket.")
+@click.option('-f', '--force', is_flag=True,
+              help="Replace an existing socket file.")
+@command_processor
+def cmd(message, **kwargs):
+    """The *serve* command keeps the ndeftool running as a server that
+    accepts pipeline requests on the Unix domain socket given by
+    '--socket'. Each request is the argument list of an ndeftool
+    command line plus the octets for standard input, the working
+    directory and the NDEFTOOL_ environment variables of the client.
+    The pipeline runs within that directory and environment, and is
+    answered with the exit status and the standard output and
+    standard error octets. An unexpected error is answered with exit
+    status 1 and the server continues. Because click, ndef and libmagic are
+    loaded only once the cost per request is close to the time needed
+    to process the records. Requests are processed one at a time.
+
+    The 'ndeftool-client' executable accepts the same command line as
+    the ndeftool and sends it to the server found at the path in the
+    NDEFTOOL_SOCKET environment variable. Standard input is only read
+    and sent when the pipeline reads it. If the variable is not set
+    or no server is listening the command line is processed locally.
+
+    The server runs until it is interrupted. The socket file is
+    removed on exit. An existing socket file is only replaced when
+    '--force' is given.
+
+    \b
+    Examples:
+      ndeftool serve --socket /tmp/ndeftool.sock &
+      export NDEFTOOL_SOCKET=/tmp/ndeftool.sock
+      ndeftool-client text 'Hello World' print
+
+    """
+    dmsg(__name__ + ' ' + str(kwargs))
+
+    path = kwargs['path']
+
+    if os.path.exists(path):
+        if not kwargs['force']:
+            errmsg = "path '%s' exists. Use '--force' to replace."
+            raise click.ClickException(errmsg % path)
+        os.unlink(path)
+
+    daemon.warm_up()
+    info("Serving pipelines on %s" % path)
+    try:
+        daemon.serve(path)
+    except KeyboardInterrupt:
+        info("Stopped serving on %s" % path)
+    except (OSError, IOError) as error:
+        raise click.ClickException(str(error))
+
+    return message if message is not None else []
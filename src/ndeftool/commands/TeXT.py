@@ -3,7 +3,7 @@
 import click
 import ndef
 
-from ndeftool.cli import command_processor, dmsg
+from ndeftool.cli import command_processor, extend, dmsg
 
 
 @click.command(short_help="Create an NFC Forum Text Record.")
@@ -29,14 +29,10 @@ def cmd(message, **kwargs):
     """
     dmsg(__name__ + ' ' + str(kwargs))
 
-    if message is None:
-        message = []
-
     content = kwargs['text']
     language = kwargs['language']
     encoding = kwargs['encoding']
 
     record = ndef.TextRecord(content, language, encoding)
 
-    message.append(record)
-    return message
+    return extend(message, [record])
@@ -3,7 +3,7 @@
 import click
 import ndef
 
-from ndeftool.cli import command_processor, dmsg
+from ndeftool.cli import command_processor, extend, dmsg
 
 
 @click.command(short_help="Create an NFC Forum URI Record.")
@@ -21,10 +21,6 @@ def cmd(message, **kwargs):
     """
     dmsg(__name__ + ' ' + str(kwargs))
 
-    if message is None:
-        message = []
-
     record = ndef.UriRecord(kwargs['resource'])
 
-    message.append(record)
-    return message
+    return extend(message, [record])
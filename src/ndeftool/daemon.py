@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Run ndeftool pipelines in a warm server process.
+
+The server listens on a Unix domain socket and runs each request
+within the same interpreter, so that click, ndef and libmagic are
+only loaded once. A request is a JSON object with the argument list,
+the working directory and the NDEFTOOL_ environment variables of the
+client. The server runs the pipeline within that working directory and
+environment. When the pipeline first reads standard input the server
+sends an input request and the client answers with all octets of its
+standard input, so that a pipeline which does not read standard input
+leaves it to the caller. The response is the exit status and the
+octets written to standard output and standard error. The input
+request and the response start with a tag octet, each data part is
+sent as a frame of 8 byte length plus data.
+
+"""
+import io
+import os
+import sys
+import json
+import errno
+import struct
+import socket
+import traceback
+
+FRAME_HEADER = struct.Struct('>Q')
+INPUT_REQUEST = b'I'
+RESPONSE = b'R'
+SOCKET_ENVVAR = 'NDEFTOOL_SOCKET'
+ENVVAR_PREFIX = 'NDEFTOOL_'
+
+
+def send_frame(sock, data):
+    sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+
+def recv_frame(sock):
+    size = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))[0]
+    return recv_exactly(sock, size)
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise EOFError("connection closed within frame")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+class RequestInput(io.RawIOBase):
+    """Standard input of a request that is read from the client when the
+    pipeline reads it for the first time.
+
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.octets = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.octets is None:
+            self.sock.sendall(INPUT_REQUEST)
+            self.octets = io.BytesIO(recv_frame(self.sock))
+        return self.octets.readinto(buffer)
+
+
+def warm_up():
+    """Import all command modules and load the libmagic database so that
+    the first request does not pay for it.
+
+    """
+    from ndeftool.cli import command_registry
+    from ndeftool import mimetype
+    for _, module, _ in set(command_registry().values()):
+        __import__(module)
+    mimetype.from_magic(b'')
+
+
+def serve(path, handler=None):
+    """Accept connections on the Unix domain socket at path and run one
+    pipeline request per connection until interrupted.
+
+    """
+    from ndeftool.cli import call_pipeline
+    handler = handler or call_pipeline
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(path)
+        server.listen(16)
+        while True:
+            connection, _ = server.accept()
+            try:
+                message = json.loads(recv_frame(connection).decode('utf-8'))
+                stdin = io.BufferedReader(RequestInput(connection))
+                status, stdout, stderr = run_request(handler, message, stdin)
+                connection.sendall(RESPONSE + struct.pack('>i', status))
+                send_frame(connection, stdout)
+                send_frame(connection, stderr)
+            except (EOFError, ValueError, socket.error):
+                pass  # a broken request must not stop the server
+            finally:
+                connection.close()
+    finally:
+        server.close()
+        os.unlink(path)
+
+
+def run_request(handler, message, stdin):
+    """Run the handler with the args of the request message and stdin,
+    within the working directory and NDEFTOOL_ environment variables
+    of the request. An exception raised by the request is returned as
+    exit status 1 with the traceback as standard error, so that the
+    client always gets a response and the server keeps running.
+
+    """
+    cwd, environ = os.getcwd(), dict(os.environ)
+    try:
+        os.chdir(message['cwd'])
+        for name in list(os.environ):
+            if name.startswith(ENVVAR_PREFIX):
+                del os.environ[name]
+        os.environ.update(message['env'])
+        return handler(message['args'], stdin)
+    except Exception:
+        return 1, b'', traceback.format_exc().encode('utf-8')
+    finally:
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+def request(path, args, stdin=b'', cwd=None, env=None):
+    """Send the pipeline args to the server listening at path and return
+    the tuple of exit status, stdout and stderr. The stdin octets or
+    binary file are only sent, and a file only read, if the pipeline
+    reads standard input. The pipeline runs in the cwd directory with
+    the env variables, by default the current directory and NDEFTOOL_
+    environment variables.
+
+    """
+    if env is None:
+        env = dict((name, value) for name, value in os.environ.items()
+                   if name.startswith(ENVVAR_PREFIX))
+    message = {'args': list(args), 'cwd': cwd or os.getcwd(), 'env': env}
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        send_frame(sock, json.dumps(message).encode('utf-8'))
+        while recv_exactly(sock, 1) == INPUT_REQUEST:
+            if not isinstance(stdin, bytes):
+                stdin = stdin.read()
+            send_frame(sock, stdin)
+        status = struct.unpack('>i', recv_exactly(sock, 4))[0]
+        return status, recv_frame(sock), recv_frame(sock)
+    finally:
+        sock.close()
+
+
+def client_main():
+    """Entry point that stands in for the ndeftool executable. The
+    command line is run by the server found at the NDEFTOOL_SOCKET
+    path or, if that is not set or no server is listening, by the
+    regular ndeftool main function within this process.
+
+    """
+    path = os.environ.get(SOCKET_ENVVAR)
+    if path:
+        stdin = b'' if sys.stdin.isatty() else sys.stdin.buffer
+        try:
+            status, stdout, stderr = request(path, sys.argv[1:], stdin)
+        except socket.error as error:
+            if error.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                raise
+        else:
+            sys.stdout.buffer.write(stdout)
+            sys.stderr.buffer.write(stderr)
+            sys.exit(status)
+
+    from ndeftool.cli import main
+    main(prog_name='ndeftool')
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Sidecar index of the records in an NDEF file.
+
+The index of FILE is written to FILE.idx and holds a header, one
+fixed size entry per record and the number of the first record of
+each message. An entry has the record offset, the first record octet
+with the MB, ME, CF, SR, IL and TNF bits, and the TYPE_LENGTH,
+ID_LENGTH and PAYLOAD_LENGTH fields. The position of any record is
+thus found by a single seek into the index.
+
+The header stores the size and modification time of FILE when it was
+indexed, an index that does not match the current file is ignored.
+
+"""
+import os
+import array
+import struct
+
+from ndeftool.scan import scan_headers, record_length, ScanError
+
+SUFFIX = '.idx'
+MAGIC = b'NDEFIDX1'
+HEADER = struct.Struct('>8sQQQQ')
+ENTRY = struct.Struct('>QBBBL')
+MESSAGE = struct.Struct('>Q')
+
+
+class IndexFileError(Exception):
+    pass
+
+
+def write_index(path, index_path=None):
+    """Write the index of the NDEF file at path and return the number of
+    records and messages indexed. The index is written to a temporary
+    file that replaces index_path, by default path + SUFFIX, when
+    complete.
+
+    """
+    index_path = index_path or path + SUFFIX
+    temp_path = index_path + '.tmp'
+    messages = array.array('Q')
+    records = 0
+    with open(path, 'rb') as f:
+        file_stat = os.fstat(f.fileno())
+        with open(temp_path, 'wb') as index:
+            try:
+                index.write(HEADER.pack(MAGIC, 0, 0, 0, 0))
+                for header in scan_headers(f):
+                    if header.mb or records == 0:
+                        messages.append(records)
+                    index.write(ENTRY.pack(
+                        header.offset, header.octet0, len(header.type),
+                        len(header.id), header.payload_length))
+                    records += 1
+                index.write(b''.join(MESSAGE.pack(m) for m in messages))
+                index.seek(0)
+                index.write(HEADER.pack(
+                    MAGIC, file_stat.st_size, file_stat.st_mtime_ns,
+                    records, len(messages)))
+            except BaseException:
+                index.close()
+                os.remove(temp_path)
+                raise
+    os.rename(temp_path, index_path)
+    return records, len(messages)
+
+
+class Index(object):
+    """Read access to the index file at index_path for the file with the
+    os.stat() result file_stat. Raises IndexFileError if the index is not
+    valid or does not match the file.
+
+    """
+    def __init__(self, index_path, file_stat):
+        try:
+            self.file = open(index_path, 'rb')
+        except (OSError, IOError) as error:
+            raise IndexFileError(str(error))
+        try:
+            octets = self.file.read(HEADER.size)
+            if len(octets) < HEADER.size:
+                raise IndexFileError("index file is too short")
+            magic, size, mtime, self.records, self.messages = \
+                HEADER.unpack(octets)
+            if magic != MAGIC:
+                raise IndexFileError("not an ndeftool index file")
+            if (size, mtime) != (file_stat.st_size, file_stat.st_mtime_ns):
+                raise IndexFileError("index does not match the file")
+            size = (HEADER.size + self.records * ENTRY.size +
+                    self.messages * MESSAGE.size)
+            if os.fstat(self.file.fileno()).st_size != size:
+                raise IndexFileError("index file is truncated")
+        except IndexFileError:
+            self.file.close()
+            raise
+
+    def close(self):
+        self.file.close()
+
+    def entry(self, index):
+        """Return (offset, octet0, type_length, id_length, payload_length)
+        of the record at index.
+
+        """
+        self.file.seek(HEADER.size + index * ENTRY.size)
+        return ENTRY.unpack(self.file.read(ENTRY.size))
+
+    def message(self, index):
+        """Return the number of the first record of the message at index
+        and the number of records in that message.
+
+        """
+        if index >= self.messages:
+            return self.records, 0
+        self.file.seek(HEADER.size + self.records * ENTRY.size +
+                       index * MESSAGE.size)
+        first, = MESSAGE.unpack(self.file.read(MESSAGE.size))
+        if index + 1 < self.messages:
+            after, = MESSAGE.unpack(self.file.read(MESSAGE.size))
+        else:
+            after = self.records
+        return first, after - first
+
+    def bounds(self, first, last):
+        """Return the offset of record first, the offset of record last and
+        the offset after record last.
+
+        """
+        start = self.entry(first)[0]
+        offset, octet0, type_length, id_length, payload_length = \
+            self.entry(last)
+        return start, offset, offset + record_length(
+            octet0, type_length, id_length, payload_length)
+
+    def chunked(self, first, last):
+        """Return whether record first continues a chunk sequence or
+        record last is followed by another chunk.
+
+        """
+        return bool((first > 0 and self.entry(first - 1)[1] & 0x20) or
+                    self.entry(last)[1] & 0x20)
+
+
+class MessageScan(object):
+    """The record offsets of the message at the current position of the
+    binary stream, found by scanning the record headers. Provides the
+    message() and bounds() methods of Index for a single message.
+
+    """
+    def __init__(self, stream):
+        self.offsets = array.array('Q')
+        self.octets = array.array('B')
+        header = None
+        for header in scan_headers(stream):
+            self.offsets.append(header.offset)
+            self.octets.append(header.octet0)
+            if header.me:
+                break
+        else:
+            if header is not None:
+                raise ScanError("message end not found after offset %d"
+                                % header.offset)
+        if header is not None:
+            self.offsets.append(header.offset + header.length)
+        self.records = max(len(self.offsets) - 1, 0)
+        self.messages = 1 if self.records else 0
+
+    def close(self):
+        pass
+
+    def message(self, index):
+        return 0, self.records
+
+    def bounds(self, first, last):
+        return self.offsets[first], self.offsets[last], self.offsets[last + 1]
+
+    def chunked(self, first, last):
+        return bool((first > 0 and self.octets[first - 1] & 0x20) or
+                    self.octets[last] & 0x20)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Record layouts for the decode cache.
+
+The layout of a message is the TNF, TYPE and ID fields and the
+payload position of each record, found when the message was first
+decoded. It is stored in the cache by the SHA-256 hash of the file
+content and the decode errors mode. Loading the same content again
+builds the records from the layout and the payload octets, without
+reading and validating the record headers and message structure.
+The payloads of known record types are still decoded with the same
+errors mode, the result is the same as from ndef.message_decoder().
+
+"""
+import hashlib
+import struct
+import ndef
+
+from ndeftool.cache import stat_key
+
+# TNF, TYPE_LENGTH, ID_LENGTH, payload offset and PAYLOAD_LENGTH of a
+# record, followed by the TYPE and ID octets.
+ENTRY = struct.Struct('>BBBQL')
+
+
+def layout_key(cache, data, file_stat, errors):
+    """Return the key of the layout of data when decoded with errors.
+    The content hash of a regular file with the os.stat() result
+    file_stat is looked up in the cache before data is hashed.
+
+    """
+    digest = None
+    if file_stat is not None:
+        digest = cache.get('digest', stat_key(file_stat))
+    if digest is None:
+        digest = hashlib.sha256(data).hexdigest()
+        if file_stat is not None:
+            cache.put('digest', stat_key(file_stat), digest)
+    return 'sha256:%s:%s' % (digest, errors)
+
+
+def pack_layout(headers):
+    """Return the layout octets for a sequence of scan.RecordHeader."""
+    return b''.join(ENTRY.pack(
+        header.tnf, len(header.type), len(header.id),
+        header.offset + header.length - header.payload_length,
+        header.payload_length) + header.type + header.id
+        for header in headers)
+
+
+def build_records(data, layout, errors):
+    """Yield the records of the message data from its layout. The
+    record classes are found in the same registry of known types that
+    ndef.message_decoder() uses.
+
+    """
+    known_types = ndef.Record._known_types
+    offset = 0
+    while offset < len(layout):
+        tnf, type_length, id_length, start, length = \
+            ENTRY.unpack_from(layout, offset)
+        offset += ENTRY.size
+        record_type = bytes(layout[offset:offset + type_length])
+        offset += type_length
+        record_id = bytes(layout[offset:offset + id_length])
+        offset += id_length
+        record_type = ndef.Record._decode_type(tnf, record_type)
+        payload = data[start:start + length]
+        if record_type in known_types:
+            record = known_types[record_type]._decode_payload(payload, errors)
+            record.name = record_id
+        else:
+            record = ndef.Record(record_type, record_id, payload)
+        yield record
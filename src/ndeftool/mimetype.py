@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Mimetype detection for packed files and smart poster icons.
+
+With the 'fast' detection strategy common file types are recognized
+from the first octets by a table of signatures and, for text formats
+that have no signature, by the file name extension if the content
+starts as libmagic requires for that format. Only if that is
+inconclusive, and always with the 'magic' strategy, libmagic examines
+a bounded prefix of the data.
+
+The libmagic binding is imported on first use. Loading the shared
+library and its database is a considerable part of the interpreter
+startup time and most commands never need to discover a mimetype.
+
+With a cache the mimetype found by libmagic is remembered by the
+device, inode, size and modification time of the file and by the
+SHA-256 hash of the prefix, so that libmagic is not needed at all for
+files that were seen before.
+
+"""
+import os
+import re
+import stat
+import codecs
+import struct
+
+# The number of leading octets examined by the signature table and
+# the text test, and the number of leading octets given to libmagic.
+SNIFF_SIZE = 512
+MAGIC_SIZE = 1 << 20
+
+# The number of leading octets searched for content that libmagic
+# would find within its own, smaller, search range.
+SEARCH_SIZE = 8192
+
+# Signatures are (offset, octets, mimetype) and must be conclusive,
+# that is libmagic would find the same mimetype.
+SIGNATURES = [
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'\x1f\x8b\x08', 'application/gzip'),
+    (8, b'WEBPVP8', 'image/webp'),
+    (8, b'WAVEfmt ', 'audio/x-wav'),
+    (8, b'isom', 'video/mp4'),
+    (8, b'mp41', 'video/mp4'),
+    (8, b'mp42', 'video/mp4'),
+    (8, b'avc1', 'video/mp4'),
+    (8, b'M4A ', 'audio/x-m4a'),
+    (8, b'qt  ', 'video/quicktime'),
+    (8, b'heic', 'image/heic'),
+]
+
+# Text formats are recognized by extension, a pattern that must match
+# the start of the content and octets that must not be found in the
+# first SEARCH_SIZE octets, such as an SVG root element within XML.
+# Like the signatures this must be conclusive, content that libmagic
+# finds to be of another type must not match. Plain text and JSON are
+# left to libmagic, which tells plain text from scripts and markup and
+# checks that JSON is valid.
+HTML_START = re.compile(
+    br'(\xef\xbb\xbf)?[ \t\r\n]*<(!DOCTYPE[ \t\r\n]+HTML|HTML[ \t\r\n>])',
+    re.IGNORECASE)
+EXTENSIONS = {
+    '.html': ('text/html', HTML_START, None),
+    '.htm': ('text/html', HTML_START, None),
+    '.xml': ('text/xml', re.compile(
+        br'(\xef\xbb\xbf)?<\?XML[ \t\r\n]', re.IGNORECASE), b'<svg'),
+    '.svg': ('image/svg+xml', re.compile(br'<svg[ \t\r\n>]'), None),
+    '.vcf': ('text/vcard', re.compile(
+        br'BEGIN:VCARD\r?\n', re.IGNORECASE), None),
+}
+
+_magic = None
+
+
+def from_buffer(data, cache=None, file_stat=None, name=None,
+                strategy='fast'):
+    """Return the mimetype string discovered from the data octets. The
+    'fast' strategy first tries the signature table and the extension
+    of the file name. If a cache is given, the mimetype is then looked
+    up by file_stat, the os.stat() result of the regular file that
+    holds data, and by the hash of the data prefix that libmagic
+    would examine.
+
+    """
+    if strategy == 'fast':
+        mimetype = from_signature(data) or from_extension(data, name)
+        if mimetype is not None:
+            return mimetype
+    if cache is None:
+        return from_magic(data)
+    file_key = None
+    if file_stat is not None:
+        from ndeftool.cache import stat_key
+        file_key = stat_key(file_stat)
+        mimetype = cache.get('mimetype', file_key)
+        if mimetype is not None:
+            return mimetype
+    import hashlib
+    prefix = memoryview(data)[0:MAGIC_SIZE]
+    hash_key = 'sha256:' + hashlib.sha256(prefix).hexdigest()
+    mimetype = cache.get('mimetype', hash_key)
+    if mimetype is None:
+        mimetype = from_magic(data)
+        cache.put('mimetype', hash_key, mimetype)
+    if file_key is not None:
+        cache.put('mimetype', file_key, mimetype)
+    return mimetype
+
+
+def from_signature(data):
+    """Return the mimetype for a known signature at the start of data,
+    or None.
+
+    """
+    head = bytes(memoryview(data)[0:SNIFF_SIZE])
+    for offset, signature, mimetype in SIGNATURES:
+        if head.startswith(signature, offset):
+            if offset == 8 and head[0:4] != b'RIFF' and head[4:8] != b'ftyp':
+                continue
+            return mimetype
+    if head.startswith(b'\x00\x00\x01\x00') and is_icon(head):
+        return 'image/vnd.microsoft.icon'
+
+
+def is_icon(head):
+    # The ICO header is too short to be a signature. The first
+    # directory entry must also be plausible.
+    if len(head) < 22:
+        return False
+    count = struct.unpack('<H', head[4:6])[0]
+    reserved, planes, bits, offset = struct.unpack('<BHHxxxxI', head[9:22])
+    return (0 < count < 256 and reserved == 0 and planes in (0, 1) and
+            bits in (0, 1, 4, 8, 16, 24, 32) and offset >= 6 + 16 * count)
+
+
+def from_extension(data, name):
+    """Return the mimetype for the extension of the file name if data
+    is text that starts as required for that format, or None.
+
+    """
+    if not name:
+        return None
+    mimetype, start, exclude = EXTENSIONS.get(
+        os.path.splitext(name)[1].lower(), (None, None, None))
+    head = bytes(memoryview(data)[0:SNIFF_SIZE])
+    if mimetype is None or not head or b'\x00' in head:
+        return None
+    try:
+        # A multi-byte sequence may be cut at the end of head, the
+        # incremental decoder does not fail on incomplete input.
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+    except UnicodeDecodeError:
+        return None
+    if exclude and exclude in bytes(
+            memoryview(data)[0:SEARCH_SIZE]).lower():
+        return None
+    if start.match(head):
+        return mimetype
+
+
+def from_magic(data):
+    """Return the mimetype string that libmagic discovers from the first
+    MAGIC_SIZE octets of data. The data may also be a memoryview, for
+    example of a memory mapped file.
+
+    """
+    global _magic
+    if _magic is None:
+        import magic
+        _magic = magic.Magic(mime=True)
+    if isinstance(data, memoryview) or len(data) > MAGIC_SIZE:
+        data = memoryview(data)[0:MAGIC_SIZE].tobytes()
+    return _magic.from_buffer(data)
+
+
+def file_stat(f):
+    """Return the os.stat() result for the open file f if that is a
+    regular file, otherwise None.
+
+    """
+    try:
+        result = os.fstat(f.fileno())
+    except (AttributeError, ValueError, OSError):
+        return None
+    return result if stat.S_ISREG(result.st_mode) else None
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Record classes used within the ndeftool processing pipeline."""
+from binascii import hexlify
+import click
+import ndef
+
+
+class FileRecord(ndef.Record):
+    """An NDEF Record with the content of a file as payload. The file is
+    only read when the data attribute is accessed, usually when the
+    record is encoded or saved, and the data is not kept. Until then
+    the record only holds the path and size of the file.
+
+    """
+    def __init__(self, type, name, path, size):
+        super(FileRecord, self).__init__(type, name)
+        self.path = path
+        self.size = size
+
+    @property
+    def data(self):
+        return self.read()
+
+    def read(self, size=-1):
+        """Return up to size octets of the file, all if size is negative."""
+        try:
+            with open(self.path, 'rb') as f:
+                return f.read(size)
+        except (OSError, IOError) as error:
+            errmsg = "can not read payload of record '%s': %s"
+            raise click.ClickException(errmsg % (self.name, error))
+
+    def __format__(self, format_spec):
+        # The printed data summary needs only the first octets.
+        if format_spec == 'data':
+            s = "PAYLOAD {} byte".format(self.size)
+            if self.size > 0:
+                s += " '{}'".format(hexlify(self.read(10)).decode())
+            if self.size > 10:
+                s += " ... {} more".format(self.size - 10)
+            return s
+        return super(FileRecord, self).__format__(format_spec)
+
+    def __str__(self):
+        return "NDEF Record TYPE '{r.type}' ID '{r.name}' {r:data}".format(
+            r=self)
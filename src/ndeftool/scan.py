@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Locate NDEF records without decoding the record payloads.
+
+The scanner reads the header, TYPE and ID fields of each record and
+seeks over the PAYLOAD field, so that the records of a large file are
+found with a small fraction of the reads and no payload copies. Only
+the record structure is verified, a record with a malformed payload
+is found like any other.
+
+"""
+import io
+import struct
+import collections
+
+
+# The PAYLOAD_LENGTH and ID_LENGTH fields by the SR and IL flags.
+LENGTH_FIELDS = {
+    0x00: struct.Struct('>L'), 0x08: struct.Struct('>LB'),
+    0x10: struct.Struct('>B'), 0x18: struct.Struct('>BB'),
+}
+
+
+class ScanError(Exception):
+    pass
+
+
+class RecordHeader(collections.namedtuple(
+        'RecordHeader', 'offset octet0 type id payload_length')):
+    """The offset, first octet and TYPE, ID and PAYLOAD_LENGTH fields of
+    a record. The type and id are the raw octets of the TYPE and ID
+    fields.
+
+    """
+    __slots__ = ()
+
+    mb = property(lambda self: bool(self.octet0 & 0x80))
+    me = property(lambda self: bool(self.octet0 & 0x40))
+    cf = property(lambda self: bool(self.octet0 & 0x20))
+    tnf = property(lambda self: self.octet0 & 0x07)
+
+    @property
+    def length(self):
+        """The number of octets of the encoded record."""
+        return record_length(self.octet0, len(self.type), len(self.id),
+                             self.payload_length)
+
+
+def record_length(octet0, type_length, id_length, payload_length):
+    return (2 + (1 if octet0 & 0x10 else 4) + (1 if octet0 & 0x08 else 0) +
+            type_length + id_length + payload_length)
+
+
+def scan_headers(stream):
+    """Yield a RecordHeader for each record read from the binary stream,
+    from the current position to the end of stream, across message
+    boundaries. The payloads are skipped by seeking if the stream is
+    seekable and by reading otherwise. A structural error or truncated
+    record raises ScanError.
+
+    """
+    seekable = stream.seekable()
+    offset = stream.tell() if seekable else 0
+    if seekable:
+        end = stream.seek(0, io.SEEK_END)
+        stream.seek(offset)
+
+    while True:
+        octets = stream.read(2)
+        if not octets:
+            return
+        if len(octets) < 2:
+            raise ScanError("truncated record header at offset %d" % offset)
+        octet0, type_length = bytearray(octets)
+        if octet0 & 0x07 == 7:
+            raise ScanError("TNF field value 7 at offset %d" % offset)
+
+        fields = LENGTH_FIELDS[octet0 & 0x18]
+        octets = stream.read(fields.size)
+        if len(octets) < fields.size:
+            raise ScanError("truncated record header at offset %d" % offset)
+        payload_length, id_length = (fields.unpack(octets) + (0,))[0:2]
+
+        record_type = stream.read(type_length)
+        record_id = stream.read(id_length)
+        if len(record_type) + len(record_id) < type_length + id_length:
+            raise ScanError("truncated record at offset %d" % offset)
+
+        header = RecordHeader(offset, octet0, record_type, record_id,
+                              payload_length)
+        offset += header.length
+        if seekable:
+            if offset > end:
+                raise ScanError("truncated record at offset %d"
+                                % header.offset)
+            stream.seek(offset)
+        else:
+            skip_octets(stream, payload_length, header.offset)
+        yield header
+
+
+def skip_octets(stream, size, offset):
+    while size > 0:
+        octets = stream.read(min(size, 1 << 16))
+        if not octets:
+            raise ScanError("truncated record at offset %d" % offset)
+        size -= len(octets)
+
+
+def scan_message(stream, strict=False):
+    """Yield a RecordHeader for each record of the NDEF message read from
+    the binary stream, up to the record with the ME flag set. With
+    strict the MB flag must be set only in the first record and the
+    ME flag in the last record, as for ndef.message_decoder() with
+    errors 'strict', otherwise ScanError is raised.
+
+    """
+    first = True
+    for header in scan_headers(stream):
+        if strict and header.mb != first:
+            raise ScanError("MB flag %s in %s record" % (
+                ("set", "not set")[first], ("middle", "first")[first]))
+        first = False
+        yield header
+        if header.me:
+            return
+    if strict and not first:
+        raise ScanError("ME flag not set in last record")
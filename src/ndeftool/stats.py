@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Per command statistics for the ndeftool processing pipeline.
+
+Each pipeline stage accumulates the wall clock time and peak memory
+growth while it is active, the number of records received and
+produced and the number of octets decoded or encoded. Stages are
+tracked on a stack because in --stream mode the records are pulled
+through all stages at once, time spent in an upstream stage is then
+not counted for the stage that requested the record.
+
+"""
+import io
+import timeit
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+def maxrss():
+    """Return the peak resident set size of the process in KiB, or 0 if
+    it can not be determined on this platform.
+
+    """
+    if resource is None:  # pragma: no cover
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Stage(object):
+    def __init__(self, name):
+        self.name = name
+        self.time = 0.0
+        self.records_in = 0
+        self.records_out = 0
+        self.decoded = 0
+        self.encoded = 0
+        self.rss = 0
+
+
+class PipelineStats(object):
+    def __init__(self):
+        self.stages = []
+        self.stack = []
+        self.mark = (timeit.default_timer(), maxrss())
+
+    def add_stage(self, name):
+        stage = Stage(name)
+        self.stages.append(stage)
+        return stage
+
+    def account(self):
+        # Attribute the time and peak memory growth since the last
+        # mark to the stage on top of the stack.
+        mark = (timeit.default_timer(), maxrss())
+        if self.stack:
+            self.stack[-1].time += mark[0] - self.mark[0]
+            self.stack[-1].rss += mark[1] - self.mark[1]
+        self.mark = mark
+
+    def enter(self, stage):
+        self.account()
+        self.stack.append(stage)
+
+    def leave(self):
+        self.account()
+        self.stack.pop()
+
+    def count(self, name, value):
+        if self.stack:
+            stage = self.stack[-1]
+            setattr(stage, name, getattr(stage, name) + value)
+
+    def wrap_processor(self, processor):
+        """Return a processor that runs processor as a pipeline stage."""
+        stage = self.add_stage(getattr(processor, 'command', '?'))
+
+        def wrapped(message):
+            if message is not None:
+                message = self.records_in(stage, message)
+            self.enter(stage)
+            try:
+                message = processor(message)
+            finally:
+                self.leave()
+            if isinstance(message, list):
+                stage.records_out += len(message)
+            elif message is not None:
+                message = self.records_out(stage, message)
+            return message
+
+        return wrapped
+
+    def records_in(self, stage, message):
+        if isinstance(message, list):
+            stage.records_in += len(message)
+            return message
+        return self._records_in(stage, message)
+
+    def _records_in(self, stage, message):
+        for record in message:
+            stage.records_in += 1
+            yield record
+
+    def records_out(self, stage, message):
+        records = iter(message)
+        while True:
+            self.enter(stage)
+            try:
+                record = next(records)
+            except StopIteration:
+                return
+            finally:
+                self.leave()
+            stage.records_out += 1
+            yield record
+
+    def report(self):
+        """Return the statistics table as a list of text lines."""
+        fmt = "{:>3} {:12} {:>10} {:>8} {:>8} {:>10} {:>10} {:>8}"
+        lines = [fmt.format('#', 'command', 'time/ms', 'rec-in', 'rec-out',
+                            'decoded', 'encoded', 'rss/KiB')]
+        for index, stage in enumerate(self.stages):
+            lines.append(fmt.format(
+                index + 1 if index + 1 < len(self.stages) else '',
+                stage.name, '%.3f' % (stage.time * 1000), stage.records_in,
+                stage.records_out, stage.decoded, stage.encoded, stage.rss))
+        return lines
+
+
+class CountingReader(io.RawIOBase):
+    """A raw binary stream that reads from stream and counts the octets
+    read for the current stage of stats.
+
+    """
+    def __init__(self, stream, stats):
+        self.stream = stream
+        self.stats = stats
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        octets = self.stream.read(len(buffer))
+        buffer[0:len(octets)] = octets
+        self.stats.count('decoded', len(octets))
+        return len(octets)
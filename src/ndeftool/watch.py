@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Wait for changes of the files selected by load --watch.
+
+A change is any difference in the list of selected files or in the
+size, modification time or inode of a selected file, so that files
+written by the pipeline itself into a watched directory do not cause
+another run. On Linux the directories of the selected files are
+watched with inotify and the file selection is only examined again
+when an event arrives, elsewhere it is examined periodically.
+
+The watcher also keeps the records loaded from each file, keyed by
+the file status and load options, so that a run after a change only
+loads the files that have changed.
+
+"""
+import os
+import copy
+import time
+import errno
+import select
+import ctypes
+import ctypes.util
+
+POLL_INTERVAL = 1.0
+SETTLE_TIME = 0.2
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+           IN_CREATE | IN_DELETE)
+
+
+class Watcher(object):
+    def __init__(self):
+        self.selections = []
+        self.snapshot = {}
+        self.records = {}
+        self.used = set()
+        self.renew = False
+        self.inotify = Inotify.open()
+
+    def begin(self):
+        """Replace the file selections when the pipeline runs again. The
+        previous selections are kept if the run fails before load.
+
+        """
+        self.renew = True
+        self.used = set()
+
+    def watch(self, selection, directories):
+        """Add the file selection function, which returns the list of
+        selected file names, and the directories where new files may
+        appear. Returns the file names currently selected.
+
+        """
+        if self.renew:
+            self.selections, self.renew = [], False
+        filenames = list(selection())
+        self.selections.append(selection)
+        self.snapshot.update(take_snapshot(filenames))
+        if self.inotify is not None:
+            directories = set(directories)
+            directories.update(os.path.dirname(fn) or '.' for fn in filenames)
+            for directory in directories:
+                self.inotify.add_watch(directory)
+        return filenames
+
+    def load(self, filename, options, load_records):
+        """Return the records loaded from filename with options, either
+        copies of the records from the previous run if the file has not
+        changed or the records returned by load_records.
+
+        """
+        try:
+            key = (filename, stat_key(os.stat(filename)), options)
+        except OSError:
+            return load_records()
+        self.used.add(key)
+        records = self.records.get(key)
+        if records is None:
+            records = self.records[key] = list(load_records())
+        # Later commands may modify the records they are given.
+        return copy.deepcopy(records)
+
+    def wait(self):
+        """Block until the selected files have changed. Records of files
+        that were not loaded by the last run are forgotten.
+
+        """
+        self.records = dict((key, value) for key, value
+                            in self.records.items() if key in self.used)
+        while True:
+            if self.inotify is not None:
+                self.inotify.wait(SETTLE_TIME)
+            else:
+                time.sleep(POLL_INTERVAL)
+            snapshot = {}
+            for selection in self.selections:
+                snapshot.update(take_snapshot(selection()))
+            if snapshot != self.snapshot:
+                self.snapshot = snapshot
+                return
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+
+def stat_key(file_stat):
+    return file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino
+
+
+def take_snapshot(filenames):
+    snapshot = {}
+    for filename in filenames:
+        try:
+            snapshot[filename] = stat_key(os.stat(filename))
+        except OSError:
+            snapshot[filename] = None
+    return snapshot
+
+
+class Inotify(object):
+    """Directory watches with the Linux inotify interface. The events
+    are not parsed, they only indicate that something has changed.
+
+    """
+    def __init__(self, libc, fd):
+        self.libc = libc
+        self.fd = fd
+
+    @classmethod
+    def open(cls):
+        """Return an Inotify instance, or None if inotify is not
+        available on this system.
+
+        """
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        return cls(libc, fd) if fd >= 0 else None
+
+    def add_watch(self, directory):
+        # Adding an existing watch only updates its mask, a directory
+        # that was removed and created again is watched again.
+        self.libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_MASK)
+
+    def wait(self, settle_time):
+        """Block until an event arrives and then until no event arrived
+        for settle_time seconds, to see a burst of changes only once.
+
+        """
+        timeout = None
+        while True:
+            try:
+                readable = select.select([self.fd], [], [], timeout)[0]
+            except (OSError, select.error) as error:
+                if error.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not readable:
+                return
+            os.read(self.fd, 65536)
+            timeout = settle_time
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division
+
+import pytest
+from ndeftool.cli import main
+
+
+@pytest.fixture
+def runner():
+    import click.testing
+    return click.testing.CliRunner()
+
+
+@pytest.fixture
+def isolated_runner(runner):
+    with runner.isolated_filesystem():
+        yield runner
+
+
+def test_help_option_prints_usage(runner):
+    result = runner.invoke(main, ['batch', '--help'])
+    assert result.exit_code == 0
+    assert result.output.startswith('Usage: main batch [OPTIONS] FILE')
+
+
+def test_abbreviated_command_name(runner):
+    result = runner.invoke(main, ['b', '--help'])
+    assert result.exit_code == 0
+    assert result.output.startswith('Usage: main b [OPTIONS] FILE')
+
+
+def test_debug_option_prints_kwargs(runner):
+    params = '--debug batch -'.split()
+    result = runner.invoke(main, params, input='')
+    assert result.exit_code == 0
+    assert result.output.startswith("ndeftool.commands.Batch {")
+
+
+def test_run_lines_from_standard_input(runner):
+    script = "text one\n\n# comment\ntext 'two words'\n"
+    result = runner.invoke(main, ['--silent', 'batch', '-'], input=script)
+    assert result.exit_code == 0
+    assert result.stdout_bytes == \
+        b'\xd1\x01\x06T\x02enone' b'\xd1\x01\x0cT\x02entwo words'
+
+
+def test_run_lines_from_file(isolated_runner):
+    with open('make.batch', 'w') as f:
+        f.write("text one id r1 save one.ndef\n")
+        f.write("text two id r2 save two.ndef\n")
+    result = isolated_runner.invoke(main, ['batch', 'make.batch'])
+    assert result.exit_code == 0
+    assert open('one.ndef', 'rb').read() == b'\xd9\x01\x06\x02Tr1\x02enone'
+    assert open('two.ndef', 'rb').read() == b'\xd9\x01\x06\x02Tr2\x02entwo'
+    assert "Finished 2 pipelines, 0 failed." in result.output
+
+
+def test_lines_do_not_share_options(runner):
+    script = "--silent load one.ndef\nunknown-command\nload two.ndef\n"
+    result = runner.invoke(main, ['batch', '-'], input=script)
+    assert result.exit_code == 1
+    assert "No files selected by path 'one.ndef'." not in result.output
+    assert "No files selected by path 'two.ndef'." in result.output
+    assert "line 2: exit status 2" in result.output
+    assert "Finished 3 pipelines, 1 failed." in result.output
+    assert "Error: 1 of 3 pipelines failed" in result.output
+
+
+def test_error_does_not_stop_batch(runner):
+    script = "text 'one\nidentifier '%s'\ntext two\n" % ('x' * 256)
+    result = runner.invoke(main, ['--silent', 'batch', '-'], input=script)
+    assert result.exit_code == 1
+    assert "line 1: No closing quotation" in result.output
+    assert "line 2: exit status 1" in result.output
+    assert "Error: 2 of 3 pipelines failed" in result.output
+    assert result.stdout_bytes.endswith(b'\xd1\x01\x06T\x02entwo')
+
+
+def test_io_error_does_not_stop_batch(isolated_runner):
+    script = "text one save missing/one.ndef\ntext two save two.ndef\n"
+    params = ['--silent', 'batch', '-']
+    result = isolated_runner.invoke(main, params, input=script)
+    assert result.exit_code == 1
+    assert "Error: FileNotFoundError: [Errno 2] No such file or directory" \
+        in result.output
+    assert "line 1: exit status 1" in result.output
+    assert "Error: 1 of 2 pipelines failed" in result.output
+    assert open('two.ndef', 'rb').read() == b'\xd1\x01\x06T\x02entwo'
+
+
+def test_parallel_jobs_keep_line_order(runner):
+    script = ''.join("text 'record %d'\n" % i for i in range(20))
+    params = ['--silent', 'batch', '--jobs', '3', '-']
+    result = runner.invoke(main, params, input=script)
+    assert result.exit_code == 0
+    assert result.stdout_bytes == b''.join(
+        b'\xd1\x01' + bytes(bytearray([len(b'record %d' % i) + 3])) +
+        b'T\x02en' + b'record %d' % i for i in range(20))
+
+
+def test_parallel_jobs_report_errors(runner):
+    script = "text one\nunknown-command\ntext 'three\ntext four\n"
+    params = ['batch', '--jobs', '2', '-']
+    result = runner.invoke(main, params, input=script)
+    assert result.exit_code == 1
+    assert "line 2: exit status 2" in result.output
+    assert "line 3: No closing quotation" in result.output
+    assert "Error: 2 of 4 pipelines failed" in result.output
+    assert result.stdout_bytes == \
+        b'\xd1\x01\x06T\x02enone' b'\xd1\x01\x07T\x02enfour'
+
+
+def test_parallel_job_exception_does_not_stop_batch(runner, monkeypatch):
+    from ndeftool.commands import Batch
+    call_pipeline = Batch.call_pipeline
+
+    def fail_pipeline(args, stdin=b''):
+        if args == ['fail']:
+            raise RuntimeError("worker failed")
+        return call_pipeline(args, stdin)
+
+    # The worker processes are forked with the patched function.
+    monkeypatch.setattr(Batch, 'call_pipeline', fail_pipeline)
+    script = "text one\nfail\ntext three\n"
+    params = ['batch', '--jobs', '2', '-']
+    result = runner.invoke(main, params, input=script)
+    assert result.exit_code == 1
+    assert "line 2: worker failed" in result.output
+    assert "Error: 1 of 3 pipelines failed" in result.output
+    assert result.stdout_bytes == \
+        b'\xd1\x01\x06T\x02enone' b'\xd1\x01\x08T\x02enthree'
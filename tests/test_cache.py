@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division
+
+import pytest
+import ndef
+from ndeftool.cli import main
+from ndeftool import cache
+
+
+@pytest.fixture
+def runner():
+    import click.testing
+    return click.testing.CliRunner()
+
+
+@pytest.fixture
+def isolated_runner(runner):
+    with runner.isolated_filesystem():
+        yield runner
+
+
+def test_help_option_prints_usage(runner):
+    result = runner.invoke(main, ['cache', '--help'])
+    assert result.exit_code == 0
+    assert result.output.startswith(
+        'Usage: main cache [OPTIONS] {stats|clear}')
+
+
+def test_abbreviated_command_name(runner):
+    result = runner.invoke(main, ['ca', '--help'])
+    assert result.exit_code == 0
+    assert result.output.startswith('Usage: main ca [OPTIONS] {stats|clear}')
+
+
+def test_debug_option_prints_kwargs(isolated_runner):
+    params = '--debug --cache-dir cache cache stats'.split()
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert result.output.startswith("ndeftool.commands.CAche {")
+
+
+def test_cache_without_directory(runner, monkeypatch):
+    monkeypatch.delenv('NDEFTOOL_CACHE_DIR', raising=False)
+    result = runner.invoke(main, 'cache stats'.split())
+    assert result.exit_code == 1
+    assert "Error: no cache directory" in result.output
+
+
+def test_cache_stats_and_clear(isolated_runner):
+    octets = b''.join(ndef.message_encoder([ndef.TextRecord('a')]))
+    open('text.ndef', 'wb').write(octets)
+    params = '--cache-dir cache cache stats'.split()
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    lines = result.stdout_bytes.decode().splitlines()
+    assert lines[0].split() == \
+        ['table', 'entries', 'octets', 'max-entries', 'max-octets']
+    assert lines[1].split()[0:2] == ['decode', '0']
+    isolated_runner.invoke(main, '--cache-dir cache load text.ndef'.split())
+    result = isolated_runner.invoke(main, params)
+    lines = result.stdout_bytes.decode().splitlines()
+    assert [line.split()[0:2] for line in lines[1:]] == \
+        [['decode', '1'], ['digest', '1'], ['mimetype', '0']]
+    params = '--cache-dir cache cache --table decode clear'.split()
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert "Cleared decode in cache" in result.stderr
+    result = isolated_runner.invoke(main, params[:2] + ['cache', 'stats'])
+    lines = result.stdout_bytes.decode().splitlines()
+    assert [line.split()[0:2] for line in lines[1:]] == \
+        [['decode', '0'], ['digest', '1'], ['mimetype', '0']]
+
+
+def test_cache_clear_unknown_table(isolated_runner):
+    params = '--cache-dir cache cache --table other clear'.split()
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 1
+    assert "Error: unknown cache table 'other'." in result.output
+
+
+def test_cache_forwards_records(isolated_runner):
+    params = '--cache-dir cache text a cache clear'.split()
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert list(ndef.message_decoder(result.stdout_bytes)) == \
+        [ndef.TextRecord('a')]
+
+
+def test_cache_evicts_by_value_octets(tmpdir, monkeypatch):
+    monkeypatch.setitem(cache.OCTETS, 'decode', 10)
+    directory = str(tmpdir.join('cache'))
+    for key in ('a', 'b', 'a', 'c'):
+        c = cache.Cache(directory)
+        if c.get('decode', key) is None:
+            c.put('decode', key, key.encode() * 4)
+        c.close()
+    c = cache.Cache(directory)
+    assert [c.get('decode', key) for key in 'abc'] == [b'aaaa', None, b'cccc']
+    assert dict((t, (n, s)) for t, n, s in c.stats())['decode'] == (2, 8)
+    c.close()
+
+
+def test_cache_keeps_updates_if_eviction_fails(tmpdir, monkeypatch):
+    def evict(self, table):
+        raise cache.sqlite3.OperationalError("near \"OVER\": syntax error")
+
+    directory = str(tmpdir.join('cache'))
+    c = cache.Cache(directory)
+    c.put('mimetype', 'a', 'text/plain')
+    c.put('decode', 'a', b'aaaa')
+    monkeypatch.setattr(cache.Cache, 'evict', evict)
+    c.close()
+    monkeypatch.undo()
+    c = cache.Cache(directory)
+    assert c.get('mimetype', 'a') == 'text/plain'
+    assert c.get('decode', 'a') == b'aaaa'
+    c.close()
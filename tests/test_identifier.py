@@ -55,3 +55,11 @@ def test_very_long_name_raises_error(runner):
     result = runner.invoke(main, ['id', 256*'0'])
     assert result.exit_code == 1
     assert 'Error:' in result.output
+
+
+def test_stream_changes_last_record(runner):
+    params = '--stream text one text two identifier r2'.split()
+    result = runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert result.stdout_bytes == \
+        b'\x91\x01\x06T\x02enone' b'\x59\x01\x06\x02Tr2\x02entwo'
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division
+
+import os
+import pytest
+import ndef
+from ndeftool.cli import main
+from ndeftool import index
+
+
+@pytest.fixture
+def runner():
+    import click.testing
+    return click.testing.CliRunner()
+
+
+@pytest.fixture
+def isolated_runner(runner):
+    with runner.isolated_filesystem():
+        yield runner
+
+
+def write_messages(filename, *messages):
+    with open(filename, 'wb') as f:
+        for texts in messages:
+            records = [ndef.TextRecord(text) for text in texts]
+            f.write(b''.join(ndef.message_encoder(records)))
+
+
+def test_help_option_prints_usage(runner):
+    result = runner.invoke(main, ['index', '--help'])
+    assert result.exit_code == 0
+    assert result.output.startswith('Usage: main index [OPTIONS] PATH')
+
+
+def test_abbreviated_command_name(runner):
+    result = runner.invoke(main, ['ix', '--help'])
+    assert result.exit_code == 0
+    assert result.output.startswith('Usage: main ix [OPTIONS] PATH')
+
+
+def test_debug_option_prints_kwargs(isolated_runner):
+    write_messages('texts.ndef', ['a'])
+    params = '--debug index texts.ndef'.split()
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert result.output.startswith("ndeftool.commands.IndeX {")
+
+
+def test_index_records_and_messages(isolated_runner):
+    write_messages('texts.ndef', ['a', 'bb', 'ccc'], ['dddd', 'e'])
+    result = isolated_runner.invoke(main, 'index texts.ndef'.split())
+    assert result.exit_code == 0
+    assert result.stdout_bytes == b''
+    assert "Indexed 5 record(s) in 2 message(s)" in result.stderr
+    records = index.Index('texts.ndef.idx', os.stat('texts.ndef'))
+    assert (records.records, records.messages) == (5, 2)
+    assert records.message(0) == (0, 3)
+    assert records.message(1) == (3, 2)
+    assert records.entry(0) == (0, 0x91, 1, 0, 4)
+    assert records.entry(4) == (38, 0x51, 1, 0, 4)
+    assert records.bounds(1, 2) == (8, 17, 27)
+    records.close()
+
+
+def test_index_output_option(isolated_runner):
+    write_messages('texts.ndef', ['a'])
+    params = 'index -o other.idx texts.ndef'.split()
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert os.path.exists('other.idx')
+    assert not os.path.exists('texts.ndef.idx')
+
+
+def test_index_forwards_records(isolated_runner):
+    write_messages('texts.ndef', ['a'])
+    params = 'text b index texts.ndef'.split()
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert list(ndef.message_decoder(result.stdout_bytes)) == \
+        [ndef.TextRecord('b')]
+
+
+def test_index_truncated_file(isolated_runner):
+    open('texts.ndef', 'wb').write(b'\xd1\x01\x09T\x02en')
+    result = isolated_runner.invoke(main, 'index texts.ndef'.split())
+    assert result.exit_code == 1
+    assert "Error: texts.ndef is not a valid NDEF file: " \
+        "truncated record at offset 0" in result.output
+    assert not os.path.exists('texts.ndef.idx.tmp')
+
+
+def test_index_does_not_match_modified_file(isolated_runner):
+    write_messages('texts.ndef', ['a'])
+    isolated_runner.invoke(main, 'index texts.ndef'.split())
+    write_messages('texts.ndef', ['a', 'b'])
+    with pytest.raises(index.IndexFileError):
+        index.Index('texts.ndef.idx', os.stat('texts.ndef'))
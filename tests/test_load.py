@@ -2,8 +2,10 @@
 
 from __future__ import absolute_import, division
 
+import io
 import os
 import pytest
+import ndef
 from ndeftool.cli import main
 
 
@@ -51,6 +53,25 @@ def test_pack_from_full_file_path(isolated_runner):
     assert result.stdout_bytes == b'\xda\n\x0b\ttext/plainhello.txtHello World'
 
 
+def test_pack_from_empty_file(isolated_runner):
+    open('empty.bin', 'w').close()
+    result = isolated_runner.invoke(main, ['load', '--pack', 'empty.bin'])
+    assert result.exit_code == 0
+    assert result.stdout_bytes == b'\xda\x13\x00\x09application/x-empty' \
+        b'empty.bin'
+
+
+def test_pack_large_file(isolated_runner):
+    data = bytes(bytearray(range(256))) * 4000
+    open('large.bin', 'wb').write(data)
+    result = isolated_runner.invoke(main, ['load', '--pack', 'large.bin'])
+    assert result.exit_code == 0
+    records = list(ndef.message_decoder(result.stdout_bytes))
+    assert len(records) == 1
+    assert records[0].name == 'large.bin'
+    assert records[0].data == data
+
+
 def test_pack_from_glob_file_path(isolated_runner):
     open('hello.txt', 'w').write('Hello World')
     result = isolated_runner.invoke(main, ['load', '--pack', '*.txt'])
@@ -96,6 +117,13 @@ def test_load_from_full_file_path(isolated_runner):
     assert result.stdout_bytes == octets
 
 
+def test_load_from_empty_file(isolated_runner):
+    open('empty.ndef', 'w').close()
+    result = isolated_runner.invoke(main, ['load', 'empty.ndef'])
+    assert result.exit_code == 0
+    assert result.stdout_bytes == b''
+
+
 def test_load_from_glob_file_path(isolated_runner):
     octets = b'\xda\n\x0b\ttext/plainhello.txtHello World'
     open('hello.txt.ndef', 'wb').write(octets)
@@ -174,3 +202,360 @@ def test_permission_denied_error(isolated_runner):
     result = isolated_runner.invoke(main, params.split())
     assert result.exit_code == 0
     assert result.output == "[Errno 13] Permission denied: 'hello.txt'\n"
+
+
+def test_stream_load_multiple_files(isolated_runner):
+    octets1 = b'\xda\n\x0b\ntext/plainhello1.txtHello World'
+    octets2 = b'\xda\n\x0b\ntext/plainhello2.txtWorld Hello'
+    open('hello1.txt.ndef', 'wb').write(octets1)
+    open('hello2.txt.ndef', 'wb').write(octets2)
+    params = '--stream load hello?.txt.ndef print'
+    result = isolated_runner.invoke(main, params.split())
+    assert result.exit_code == 0
+    assert [line[:45] for line in result.output.splitlines()] == [
+        "NDEF Record TYPE 'text/plain' ID 'hello1.txt'",
+        "loaded 1 record(s) from hello1.txt.ndef",
+        "NDEF Record TYPE 'text/plain' ID 'hello2.txt'",
+        "loaded 1 record(s) from hello2.txt.ndef",
+    ]
+
+
+@pytest.mark.parametrize("max_inflight", ['1', '100', '67108864'])
+def test_jobs_load_keeps_file_order(isolated_runner, max_inflight):
+    for index in range(20):
+        octets = bytes(bytearray([0xd1, 0x01, 0x06, 0x54, 0x02])) \
+            + b'en%03d' % index
+        open('text%03d.ndef' % index, 'wb').write(octets)
+    params = ['--silent', 'load', '--jobs', '4', '--max-inflight',
+              max_inflight, 'text*.ndef', 'print']
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert [line.split()[6] for line in result.output.splitlines()] == \
+        ["'%03d'" % index for index in range(20)]
+
+
+def test_jobs_pack_multiple_files(isolated_runner):
+    open('hello1.txt', 'w').write('Hello World')
+    open('hello2.txt', 'w').write('World Hello')
+    params = '--silent load --jobs 2 --pack hello?.txt'
+    result = isolated_runner.invoke(main, params.split())
+    assert result.exit_code == 0
+    assert result.stdout_bytes == \
+        b'\x9a\n\x0b\ntext/plainhello1.txtHello World' \
+        b'\x5a\n\x0b\ntext/plainhello2.txtWorld Hello'
+
+
+def test_jobs_load_decode_error(isolated_runner):
+    open('bad.ndef', 'wb').write(b'\x11\x01\x05T\x02en000')
+    params = 'load --jobs 2 bad.ndef'
+    result = isolated_runner.invoke(main, params.split())
+    assert result.exit_code == 1
+    assert "Error: bad.ndef does not contain a valid NDEF message." \
+        in result.output
+
+
+def test_jobs_load_stops_when_consumer_stops(isolated_runner):
+    for index in range(10):
+        octets = bytes(bytearray([0xd1, 0x01, 0x06, 0x54, 0x02])) \
+            + b'en%03d' % index
+        open('text%03d.ndef' % index, 'wb').write(octets)
+    params = '--silent --stream load --jobs 2 --max-inflight 1 text*.ndef' \
+        ' save --head 2 out.ndef'
+    result = isolated_runner.invoke(main, params.split())
+    assert result.exit_code == 0
+
+
+def test_pack_with_cache_dir(isolated_runner):
+    open('hello.txt', 'w').write('Hello World')
+    params = '--cache-dir cache load --pack hello.txt'.split()
+    for _ in range(2):
+        result = isolated_runner.invoke(main, params)
+        assert result.exit_code == 0
+        assert result.stdout_bytes == \
+            b'\xda\n\x0b\ttext/plainhello.txtHello World'
+    assert os.path.exists('cache/cache.sqlite')
+
+
+@pytest.mark.parametrize("filename, content, mimetype", [
+    ('script.txt', '#!/bin/sh\necho Hello\n', b'text/x-shellscript'),
+    ('index.html', '<!DOCTYPE html><html></html>\n', b'text/html'),
+])
+@pytest.mark.parametrize("detect", ['fast', 'magic'])
+def test_pack_with_detect_strategy(isolated_runner, detect, filename,
+                                   content, mimetype):
+    open(filename, 'w').write(content)
+    params = ['--detect', detect, 'load', '--pack', filename]
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert result.stdout_bytes[4:4 + len(mimetype)] == mimetype
+
+
+@pytest.fixture
+def tree(isolated_runner):
+    for path in ('a/x', 'a/y/z', 'b', '.git'):
+        os.makedirs(path)
+    for path in ('1.txt', 'a/2.txt', 'a/x/3.png', 'a/y/z/4.txt', 'b/5.txt',
+                 '.git/6.txt'):
+        open(path, 'w').write(path)
+    return isolated_runner
+
+
+def test_recursive_load_sorted(tree):
+    params = '--silent load -r --pack --sort . print'.split()
+    result = tree.invoke(main, params)
+    assert result.exit_code == 0
+    assert [line.split()[5] for line in result.output.splitlines()] == [
+        "'./.git/6.txt'", "'./1.txt'", "'./a/2.txt'", "'./a/x/3.png'",
+        "'./a/y/z/4.txt'", "'./b/5.txt'"]
+
+
+def test_recursive_load_include_exclude(tree):
+    params = ['--silent', 'load', '-r', '--pack', '--sort', '--include',
+              '*.txt', '--exclude', '.git', '--exclude', 'a/y', '.', 'print']
+    result = tree.invoke(main, params)
+    assert result.exit_code == 0
+    assert [line.split()[5] for line in result.output.splitlines()] == [
+        "'./1.txt'", "'./a/2.txt'", "'./b/5.txt'"]
+
+
+def test_recursive_load_unsorted_finds_all_files(tree):
+    params = '--silent --stream load -r --pack a print'.split()
+    result = tree.invoke(main, params)
+    assert result.exit_code == 0
+    assert sorted(line.split()[5] for line in result.output.splitlines()) \
+        == ["'a/2.txt'", "'a/x/3.png'", "'a/y/z/4.txt'"]
+
+
+def test_recursive_load_with_jobs(tree):
+    params = '--silent load -r -j 3 --pack --sort a print'.split()
+    result = tree.invoke(main, params)
+    assert result.exit_code == 0
+    assert [line.split()[5] for line in result.output.splitlines()] == [
+        "'a/2.txt'", "'a/x/3.png'", "'a/y/z/4.txt'"]
+
+
+def test_recursive_load_path_is_not_a_directory(tree):
+    result = tree.invoke(main, 'load -r 1.txt'.split())
+    assert result.exit_code == 1
+    assert "Error: path '1.txt' is not a directory." in result.output
+
+
+def write_archives():
+    import tarfile
+    import zipfile
+    members = [('hello.txt', b'Hello World'),
+               ('msg/text.ndef', b'\xd1\x01\x06T\x02entext')]
+    with zipfile.ZipFile('members.zip', 'w') as archive:
+        archive.writestr('msg/', b'')
+        for name, data in members:
+            archive.writestr(name, data)
+    with tarfile.open('members.tar.gz', 'w:gz') as archive:
+        for name, data in members:
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            archive.addfile(member, io.BytesIO(data))
+
+
+@pytest.mark.parametrize("archive", ['members.zip', 'members.tar.gz'])
+def test_archive_pack_members(isolated_runner, archive):
+    write_archives()
+    params = ['--silent', 'load', '--archive', '--pack', archive]
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    records = list(ndef.message_decoder(result.stdout_bytes))
+    assert [(r.type, r.name) for r in records] == [
+        ('text/plain', 'hello.txt'), ('application/octet-stream',
+                                      'msg/text.ndef')]
+    assert records[0].data == b'Hello World'
+
+
+def test_archive_load_members_from_stdin(isolated_runner):
+    write_archives()
+    params = 'load --archive - print'.split()
+    result = isolated_runner.invoke(
+        main, params, input=open('members.tar.gz', 'rb').read())
+    assert result.exit_code == 1
+    assert "Error: <stdin>:hello.txt does not contain a valid NDEF " \
+        "message." in result.output
+
+
+def test_archive_load_ndef_members(isolated_runner):
+    import zipfile
+    with zipfile.ZipFile('messages.zip', 'w') as archive:
+        archive.writestr('1.ndef', b'\xd1\x01\x04T\x02enx')
+        archive.writestr('2.ndef', b'\xd1\x01\x04T\x02eny')
+    params = 'load --archive messages.zip'.split()
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert result.stdout_bytes == \
+        b'\x91\x01\x04T\x02enx' b'\x51\x01\x04T\x02eny'
+    assert "loaded 1 record(s) from messages.zip:2.ndef" in result.stderr
+
+
+def test_archive_is_not_an_archive(isolated_runner):
+    open('hello.txt', 'w').write('Hello World')
+    result = isolated_runner.invoke(main, 'load -a hello.txt'.split())
+    assert result.exit_code == 1
+    assert "Error: hello.txt is not a zip or tar archive." in result.output
+
+
+def test_pack_lazy_equals_pack(isolated_runner):
+    open('hello1.txt', 'w').write('Hello World')
+    open('hello2.txt', 'w').write('World Hello')
+    params = '--silent load --pack hello?.txt'.split()
+    eager = isolated_runner.invoke(main, params)
+    lazy = isolated_runner.invoke(main, params[:3] + ['--lazy'] + params[3:])
+    assert lazy.exit_code == 0
+    assert lazy.stdout_bytes == eager.stdout_bytes
+
+
+def test_pack_lazy_save_head(isolated_runner):
+    for index in range(5):
+        open('file%d.txt' % index, 'w').write('text %d' % index)
+    params = '--stream load --pack --lazy file?.txt save --head 2 two.ndef'
+    result = isolated_runner.invoke(main, params.split())
+    assert result.exit_code == 0
+    assert [record.data for record in ndef.message_decoder(
+        open('two.ndef', 'rb').read())] == [b'text 0', b'text 1']
+
+
+def write_texts(filename, count):
+    records = [ndef.TextRecord('r%d' % index) for index in range(count)]
+    open(filename, 'wb').write(b''.join(ndef.message_encoder(records)))
+
+
+@pytest.mark.parametrize("select, texts", [
+    ('--skip 5 --count 3', ['r5', 'r6', 'r7']),
+    ('--skip 8 --count 5', ['r8', 'r9']),
+    ('--head 2', ['r0', 'r1']),
+    ('--tail 1', ['r9']),
+    ('--skip 2 --count 5 --tail 2', ['r5', 'r6']),
+    ('--skip 10', []),
+])
+@pytest.mark.parametrize("indexed", [False, True])
+def test_load_selected_records(isolated_runner, select, texts, indexed):
+    write_texts('texts.ndef', 10)
+    params = ['index', 'texts.ndef'] if indexed else []
+    params += ['load'] + select.split() + ['texts.ndef']
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert [record.text for record in ndef.message_decoder(
+        result.stdout_bytes)] == texts
+
+
+def test_load_selected_records_from_stdin(runner):
+    octets = b''.join(ndef.message_encoder(
+        [ndef.TextRecord('r%d' % index) for index in range(10)]))
+    params = 'load --skip 3 --count 4 --tail 2 -'.split()
+    result = runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert [record.text for record in ndef.message_decoder(
+        result.stdout_bytes)] == ['r5', 'r6']
+
+
+def test_load_selected_records_ignores_stale_index(isolated_runner):
+    write_texts('texts.ndef', 10)
+    isolated_runner.invoke(main, 'index texts.ndef'.split())
+    write_texts('texts.ndef', 12)
+    os.utime('texts.ndef', ns=(0, 0))
+    params = '--debug load --tail 1 texts.ndef'.split()
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert "index does not match the file" in result.stderr
+    assert [record.text for record in ndef.message_decoder(
+        result.stdout_bytes)] == ['r11']
+
+
+# A text/plain record in three chunks followed by a text record.
+chunked_records = (b'\xb2\x0a\x03text/plainone'
+                   b'\x36\x00\x03two'
+                   b'\x16\x00\x05three'
+                   b'\x51\x01\x05T\x02enr3')
+
+
+@pytest.mark.parametrize("select", [
+    '--count 1', '--skip 1 --count 1', '--skip 1', '--head 3', '--tail 2',
+    '--skip 3',
+])
+@pytest.mark.parametrize("indexed", [False, True])
+def test_load_selected_records_with_chunks(isolated_runner, select, indexed):
+    open('chunks.ndef', 'wb').write(chunked_records)
+    params = ['load'] + select.split()
+    stdin = isolated_runner.invoke(main, params + ['-'],
+                                   input=chunked_records)
+    assert stdin.exit_code == 0
+    params = (['index', 'chunks.ndef'] if indexed else []) + params
+    result = isolated_runner.invoke(main, params + ['chunks.ndef'])
+    assert result.exit_code == 0
+    assert result.stdout_bytes == stdin.stdout_bytes
+
+
+def test_load_selected_records_invalid_file(isolated_runner):
+    open('texts.ndef', 'wb').write(b'\xd1\x01\x09T\x02en')
+    result = isolated_runner.invoke(main, 'load --head 1 texts.ndef'.split())
+    assert result.exit_code == 1
+    assert "texts.ndef does not contain a valid NDEF message." \
+        in result.output
+
+
+def test_watch_loads_changed_files_again(isolated_runner, monkeypatch):
+    from ndeftool.watch import Watcher
+    changes = [lambda: write_texts('b.ndef', 2)]
+
+    def wait(watcher):
+        if not changes:
+            raise KeyboardInterrupt
+        changes.pop()()
+
+    monkeypatch.setattr(Watcher, 'wait', wait)
+    write_texts('a.ndef', 1)
+    write_texts('b.ndef', 1)
+    result = isolated_runner.invoke(main, 'load --watch ?.ndef'.split())
+    assert result.exit_code == 0
+    assert result.stdout_bytes == \
+        b'\x91\x01\x05T\x02enr0' b'\x51\x01\x05T\x02enr0' \
+        b'\x91\x01\x05T\x02enr0' b'\x11\x01\x05T\x02enr0' \
+        b'\x51\x01\x05T\x02enr1'
+    assert result.stderr.count("loaded 1 record(s) from a.ndef") == 1
+    assert result.stderr.count("loaded 1 record(s) from b.ndef") == 1
+    assert result.stderr.count("loaded 2 record(s) from b.ndef") == 1
+    assert "Files changed, running the pipeline again." in result.stderr
+
+
+def test_watch_standard_input(runner):
+    result = runner.invoke(main, 'load --watch -'.split())
+    assert result.exit_code == 1
+    assert "Error: standard input can not be watched." in result.output
+
+
+@pytest.mark.parametrize("errors", [[], ['--relax']])
+def test_load_with_decode_cache(isolated_runner, errors):
+    records = [ndef.TextRecord('a'), ndef.UriRecord('http://b'),
+               ndef.SmartposterRecord('http://c', 'title'),
+               ndef.Record('unknown', 'id', b'data'),
+               ndef.Record('urn:nfc:ext:nfcpy.org:x', '', b'')]
+    octets = b''.join(ndef.message_encoder(records))
+    open('records.ndef', 'wb').write(octets)
+    params = ['--debug', '--cache-dir', 'cache'] + errors + \
+        ['load', 'records.ndef']
+    first = isolated_runner.invoke(main, params)
+    second = isolated_runner.invoke(main, params)
+    assert first.exit_code == second.exit_code == 0
+    assert "found in decode cache" not in first.stderr
+    assert "found in decode cache" in second.stderr
+    assert first.stdout_bytes == second.stdout_bytes == octets
+    assert "loaded 5 record(s) from records.ndef" in second.stderr
+    params = ['--debug', '--cache-dir', 'cache', '--ignore', 'load',
+              'records.ndef']
+    result = isolated_runner.invoke(main, params)
+    assert "found in decode cache" not in result.stderr
+
+
+def test_load_with_decode_cache_after_change(isolated_runner):
+    open('text.ndef', 'wb').write(b'\xd1\x01\x04T\x02ena')
+    params = '--debug --cache-dir cache load text.ndef'.split()
+    isolated_runner.invoke(main, params)
+    open('text.ndef', 'wb').write(b'\xd1\x01\x05T\x02enbc')
+    result = isolated_runner.invoke(main, params)
+    assert "found in decode cache" not in result.stderr
+    assert result.stdout_bytes == b'\xd1\x01\x05T\x02enbc'
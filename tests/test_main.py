@@ -2,8 +2,12 @@
 
 from __future__ import absolute_import, division
 
+import io
+import subprocess
+import sys
 import pytest
-from ndeftool.cli import main
+import ndef
+from ndeftool.cli import main, command_registry, write_message
 
 
 @pytest.fixture
@@ -12,6 +16,12 @@ def runner():
     return click.testing.CliRunner()
 
 
+@pytest.fixture
+def isolated_runner(runner):
+    with runner.isolated_filesystem():
+        yield runner
+
+
 def test_no_command_prints_usage(runner):
     result = runner.invoke(main)
     assert result.exit_code == 0
@@ -32,3 +42,125 @@ def test_unknown_command_prints_error(runner):
     assert result.output.startswith(
         'Usage: main [OPTIONS] COMMAND1 [ARGS]... [COMMAND2 [ARGS]...]...')
     assert "Error:" in result.output
+
+
+def test_help_option_lists_commands(runner):
+    result = runner.invoke(main, ['--help'])
+    assert result.exit_code == 0
+    assert "  txt, text         Create an NFC Forum Text Record.\n" \
+        in result.output
+
+
+def test_command_registry_maps_full_and_short_names():
+    registry = command_registry()
+    assert registry['text'] is registry['txt']
+    assert registry['text'] == ('TeXT', 'ndeftool.commands.TeXT',
+                                'Create an NFC Forum Text Record.')
+    assert command_registry() is registry
+
+
+def test_help_option_does_not_import_commands():
+    script = ("import sys; from ndeftool.cli import main\n"
+              "try: main(['--help'])\n"
+              "except SystemExit: pass\n"
+              "assert not [m for m in sys.modules if '.commands.' in m]")
+    subprocess.check_call([sys.executable, '-c', script])
+
+
+class WriteCounter(io.BytesIO):
+    def __init__(self):
+        super(WriteCounter, self).__init__()
+        self.writes = []
+
+    def write(self, octets):
+        self.writes.append(bytes(octets))
+        return super(WriteCounter, self).write(octets)
+
+
+def test_write_message_flushes_each_record():
+    stream = WriteCounter()
+    message = [ndef.TextRecord('one'), ndef.TextRecord('two')]
+    write_message(message, stream, 0)
+    assert stream.writes == [b'\x91\x01\x06T\x02enone',
+                             b'\x51\x01\x06T\x02entwo']
+
+
+def test_write_message_collects_buffer_size():
+    stream = WriteCounter()
+    message = [ndef.TextRecord('one'), ndef.TextRecord('two')]
+    write_message(message, stream, 20)
+    assert stream.writes == [b'\x91\x01\x06T\x02enone'
+                             b'\x51\x01\x06T\x02entwo']
+
+
+def test_buffer_size_option(runner):
+    params = '--buffer-size 1 text one text two'.split()
+    result = runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert result.stdout_bytes == \
+        b'\x91\x01\x06T\x02enone' b'\x51\x01\x06T\x02entwo'
+
+
+def test_split_runs_pipeline_per_message(runner):
+    octets = b'\xd1\x01\x04T\x02enx' \
+        b'\x91\x01\x04T\x02eny\x51\x01\x04T\x02enz'
+    params = '--split text w'.split()
+    result = runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert result.stdout_bytes == \
+        b'\x91\x01\x04T\x02enx\x51\x01\x04T\x02enw' \
+        b'\x91\x01\x04T\x02eny\x11\x01\x04T\x02enz\x51\x01\x04T\x02enw'
+
+
+def test_split_with_stream_and_print(runner):
+    octets = b'\xd1\x01\x04T\x02enx' b'\xd1\x01\x04T\x02eny'
+    params = '--stream --split print'.split()
+    result = runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert [line.split()[6] for line in result.output.splitlines()] == \
+        ["'x'", "'y'"]
+
+
+def test_split_stops_at_decode_error(runner):
+    octets = b'\xd1\x01\x04T\x02enx' b'\x11\x01\x04T\x02eny'
+    result = runner.invoke(main, ['--split', 'print'], input=octets)
+    assert result.exit_code == 1
+    assert result.output.splitlines() == [
+        "NDEF Text Record ID '' Text 'x' Language 'en' Encoding 'UTF-8'",
+        "Error: MB flag not set in first record"]
+
+
+def test_stats_option_prints_table(runner):
+    params = '--stats text one text two print --keep'.split()
+    result = runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert result.stdout_bytes.endswith(
+        b'\x91\x01\x06T\x02enone' b'\x51\x01\x06T\x02entwo')
+    rows = [line.split() for line in result.stderr.splitlines()]
+    assert rows[0] == ['#', 'command', 'time/ms', 'rec-in', 'rec-out',
+                       'decoded', 'encoded', 'rss/KiB']
+    assert [row[:2] + row[3:7] for row in rows[1:4]] == [
+        ['1', 'text', '0', '1', '0', '0'],
+        ['2', 'text', '1', '2', '0', '0'],
+        ['3', 'print', '2', '2', '0', '0']]
+    assert rows[4][:1] + rows[4][2:6] == ['<stdout>', '2', '0', '0', '20']
+
+
+@pytest.mark.parametrize("stream", [[], ['--stream']])
+def test_stats_option_counts_octets(isolated_runner, stream):
+    octets = b'\x91\x01\x04T\x02enx' b'\x51\x01\x04T\x02eny'
+    params = stream + '--stats save --keep out.ndef'.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    rows = [line.split() for line in result.stderr.splitlines()]
+    assert [row[:2] + row[3:7] for row in rows[-2:-1]] == [
+        ['1', 'save', '0', '2', '16', '16']]
+
+
+def test_profile_option_writes_file(runner, tmpdir):
+    import pstats
+    path = str(tmpdir.join('ndeftool.prof'))
+    result = runner.invoke(main, ['--profile', path, 'text', 'one'])
+    assert result.exit_code == 0
+    assert result.stdout_bytes == b'\xd1\x01\x06T\x02enone'
+    assert pstats.Stats(path).total_calls > 0
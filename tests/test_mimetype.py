@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division
+
+import os
+import pytest
+from ndeftool import mimetype, cache
+
+
+@pytest.fixture
+def mimetype_cache(tmpdir):
+    return cache.Cache(str(tmpdir.join('cache')))
+
+
+def test_from_buffer_without_cache():
+    assert mimetype.from_buffer(b'Hello World') == 'text/plain'
+
+
+def test_from_buffer_memoryview():
+    assert mimetype.from_buffer(memoryview(b'Hello World')) == 'text/plain'
+
+
+def test_cache_lookup_by_content(tmpdir, mimetype_cache, monkeypatch):
+    assert mimetype.from_buffer(b'Hello', mimetype_cache) == 'text/plain'
+    mimetype_cache.close()
+    monkeypatch.setattr(mimetype, 'from_magic', None)
+    mimetype_cache = cache.Cache(str(tmpdir.join('cache')))
+    assert mimetype.from_buffer(b'Hello', mimetype_cache) == 'text/plain'
+
+
+def test_cache_lookup_by_file_stat(tmpdir, mimetype_cache, monkeypatch):
+    path = str(tmpdir.join('hello.txt'))
+    open(path, 'w').write('Hello')
+    with open(path, 'rb') as f:
+        file_stat = mimetype.file_stat(f)
+    assert mimetype.from_buffer(b'Hello', mimetype_cache, file_stat) == \
+        'text/plain'
+    mimetype_cache.close()
+    monkeypatch.setattr(mimetype, 'from_magic', None)
+    mimetype_cache = cache.Cache(str(tmpdir.join('cache')))
+    assert mimetype.from_buffer(b'ignored', mimetype_cache, file_stat) == \
+        'text/plain'
+
+
+def test_file_stat_is_none_for_pipe():
+    r, w = os.pipe()
+    with os.fdopen(r, 'rb') as f:
+        assert mimetype.file_stat(f) is None
+    os.close(w)
+
+
+def test_cache_evicts_least_recently_used(tmpdir, monkeypatch):
+    monkeypatch.setitem(cache.TABLES, 'mimetype', 2)
+    directory = str(tmpdir.join('cache'))
+    for key in ('a', 'b', 'a', 'c'):
+        c = cache.Cache(directory)
+        if c.get('mimetype', key) is None:
+            c.put('mimetype', key, 'text/' + key)
+        c.close()
+    c = cache.Cache(directory)
+    assert [c.get('mimetype', key) for key in 'abc'] == \
+        ['text/a', None, 'text/c']
+    c.close()
+
+
+def test_cache_directory_not_writable(tmpdir):
+    path = str(tmpdir.join('file'))
+    open(path, 'w').close()
+    with pytest.raises(cache.CacheError):
+        cache.Cache(path)
+
+
+@pytest.mark.parametrize("data, mimetype_string", [
+    (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR', 'image/png'),
+    (b'\xff\xd8\xff\xe0\x00\x10JFIF\x00', 'image/jpeg'),
+    (b'GIF89a\x01\x00\x01\x00', 'image/gif'),
+    (b'%PDF-1.4\n', 'application/pdf'),
+    (b'RIFF\x00\x00\x00\x00WEBPVP8 ', 'image/webp'),
+    (b'\x00\x00\x00\x18ftypisom\x00\x00\x02\x00', 'video/mp4'),
+    (b'\x00\x00\x00\x18ftypqt  \x00\x00\x02\x00', 'video/quicktime'),
+    (b'\x00\x00\x01\x00\x01\x00\x10\x10\x00\x00\x01\x00\x20\x00'
+     b'\x68\x04\x00\x00\x16\x00\x00\x00', 'image/vnd.microsoft.icon'),
+])
+def test_from_signature(data, mimetype_string):
+    assert mimetype.from_signature(data) == mimetype_string
+    assert mimetype.from_magic(data + bytes(64)) == mimetype_string
+
+
+@pytest.mark.parametrize("data", [
+    b'', b'Hello World', b'\x00\x00\x01\x00\x00\x00',
+    b'XXXX\x00\x00\x00\x00WEBPVP8 ',
+])
+def test_from_signature_inconclusive(data):
+    assert mimetype.from_signature(data) is None
+
+
+@pytest.mark.parametrize("name, data, mimetype_string", [
+    ('index.html', b'<!DOCTYPE html><html></html>', 'text/html'),
+    ('INDEX.HTM', b'\n  <HTML>\n<p>Hello</p></HTML>\n', 'text/html'),
+    ('doc.xml', b'\xef\xbb\xbf<?xml version="1.0"?><a/>', 'text/xml'),
+    ('logo.svg', b'<svg xmlns="http://www.w3.org/2000/svg"/>',
+     'image/svg+xml'),
+    ('card.vcf', b'BEGIN:VCARD\nVERSION:3.0\nEND:VCARD\n', 'text/vcard'),
+])
+def test_from_extension(name, data, mimetype_string):
+    assert mimetype.from_extension(data, name) == mimetype_string
+    assert mimetype.from_magic(data) == mimetype_string
+
+
+@pytest.mark.parametrize("name, data", [
+    (None, b'Hello World'),
+    ('hello.dat', b'Hello World'),
+    ('hello.txt', b'Hello World'),
+    ('data.json', b'{"a": 1}'),
+    ('index.html', b''),
+    ('index.html', b'<html>\x00'),
+    ('index.html', b'<html>\xff\xfe'),
+    ('index.htm', b'<!-- comment -->\n'),
+    ('index.html', b'<p>Hello</p>\n'),
+    ('doc.xml', b'  <?xml version="1.0"?><a/>'),
+    ('doc.xml', b'<?xml version="1.0"?>\n<svg xmlns="x"></svg>\n'),
+    ('logo.svg', b'<!-- comment -->\n'),
+    ('card.vcf', b'\xef\xbb\xbfBEGIN:VCARD\n'),
+])
+def test_from_extension_inconclusive(name, data):
+    assert mimetype.from_extension(data, name) is None
+
+
+@pytest.mark.parametrize("name, data", [
+    ('hello.txt', b'#!/usr/bin/env python\nimport os\n'),
+    ('hello.txt', b'<!DOCTYPE html><html></html>\n'),
+    ('index.htm', b'<!-- comment -->\n'),
+    ('doc.xml', b'<?xml version="1.0"?>\n<svg xmlns="x"></svg>\n'),
+])
+def test_from_buffer_agrees_with_magic(name, data):
+    assert mimetype.from_buffer(data, name=name) == mimetype.from_magic(data)
+
+
+def test_from_buffer_strategy(monkeypatch):
+    monkeypatch.setattr(mimetype, 'from_magic', lambda data: 'magic')
+    data = b'<!DOCTYPE html><html></html>'
+    assert mimetype.from_buffer(data, name='index.html') == 'text/html'
+    assert mimetype.from_buffer(data, name='index.txt') == 'magic'
+    assert mimetype.from_buffer(data, name='index.html',
+                                strategy='magic') == 'magic'
+
+
+def test_from_magic_bounded_prefix():
+    data = b'Hello World\n' * (mimetype.MAGIC_SIZE // 12 + 1)
+    assert mimetype.from_magic(data + b'\x00' * 100) == 'text/plain'
@@ -160,3 +160,93 @@ def test_long_print_smartposter_4(runner):
     assert output[0] == "NFC Forum Smart Poster Record [record #1]"
     assert output[1].split() == ["resource", "http://nfcpy.org"]
     assert output[2].split() == ["image/png", "69", "byte"]
+
+
+def test_stream_prints_records_before_decode_error(runner):
+    octets = b'\x9a\n\x0b\x02text/plainR1Hello World' b'\x1a\n\xff'
+    result = runner.invoke(main, ['print'], input=octets)
+    assert result.exit_code == 1
+    assert "NDEF Record TYPE" not in result.output
+    result = runner.invoke(main, ['--stream', 'print'], input=octets)
+    assert result.exit_code == 1
+    assert "NDEF Record TYPE 'text/plain' ID 'R1' PAYLOAD 11" in result.output
+
+
+def test_stream_keeps_print_order(runner):
+    params = '--stream text one print --keep text two print'.split()
+    result = runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert [line.split()[6] for line in result.output.splitlines()] == \
+        ["'one'", "'one'", "'two'"]
+
+
+def test_summary_print_from_standard_input(runner):
+    octets = (b'\x99\x01\x08\x02TR1\x02enHello' +
+              b'\x42\x0a\x00\x00\x01\x00text/plain' + 256 * b'x')
+    result = runner.invoke(main, '--silent print --summary'.split(),
+                           input=octets)
+    assert result.exit_code == 0
+    assert [line.split() for line in result.output.splitlines()] == [
+        ['record', 'tnf', 'type', 'id', 'length'],
+        ['1', '1', 'urn:nfc:wkt:T', 'R1', '8'],
+        ['2', '2', 'text/plain', '256']]
+
+
+def test_summary_print_from_message_pipe(runner):
+    params = '--silent text Hello id R1 print --summary'.split()
+    result = runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert [line.split() for line in result.output.splitlines()] == [
+        ['record', 'tnf', 'type', 'id', 'length'],
+        ['1', '1', 'urn:nfc:wkt:T', 'R1', '8']]
+
+
+def test_summary_print_does_not_decode_payload(runner):
+    # A text record with a language code longer than the payload.
+    octets = b'\xd1\x01\x03T\x09en'
+    result = runner.invoke(main, '--silent print'.split(), input=octets)
+    assert result.exit_code == 1
+    result = runner.invoke(main, '--silent print -s'.split(), input=octets)
+    assert result.exit_code == 0
+    assert result.output.splitlines()[1].split() == \
+        ['1', '1', 'urn:nfc:wkt:T', '3']
+
+
+def test_summary_print_does_not_read_lazy_files(isolated_runner, monkeypatch):
+    from ndeftool.records import FileRecord
+    open('hello.txt', 'w').write('Hello World')
+    monkeypatch.setattr(FileRecord, 'read', None)
+    params = '--silent load --pack --lazy hello.txt print -s'.split()
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert result.output.splitlines()[1].split() == \
+        ['1', '2', 'text/plain', 'hello.txt', '11']
+
+
+def test_summary_print_with_errors(runner):
+    octets = b'\x1a\n\x0b\x02text/plainR1Hello World'
+    result = runner.invoke(main, 'print --summary'.split(), input=octets)
+    assert result.exit_code == 1
+    assert "Error: MB flag not set in first record" in result.output
+    params = '--relax print --summary'.split()
+    result = runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert "text/plain" in result.output
+    result = runner.invoke(main, params, input=b'\xda\n\x0b\x02text')
+    assert result.exit_code == 1
+    assert "Error: truncated record at offset 0" in result.output
+
+
+def test_summary_print_with_keep_forwards_records(runner):
+    octets = b'\xda\n\x0b\x02text/plainR1Hello World'
+    params = '--silent print --summary --keep'.split()
+    result = runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert result.stdout_bytes.endswith(octets)
+
+
+def test_summary_print_with_long_format(runner):
+    result = runner.invoke(main, 'print --summary --long'.split(), input=b'')
+    assert result.exit_code == 1
+    assert "Error: '--summary' can not be used with '--long'." \
+        in result.output
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division
+
+import click
+import ndef
+import pytest
+from ndeftool.records import FileRecord
+
+
+@pytest.fixture
+def path(tmpdir):
+    path = tmpdir.join('payload.bin')
+    path.write_binary(b'0123456789abcdef')
+    return str(path)
+
+
+def test_data_is_read_on_access(path):
+    record = FileRecord('application/octet-stream', 'payload.bin', path, 16)
+    with open(path, 'wb') as f:
+        f.write(b'changed')
+    assert record.data == b'changed'
+
+
+def test_encode_equals_generic_record(path):
+    record = FileRecord('application/octet-stream', 'payload.bin', path, 16)
+    generic = ndef.Record('application/octet-stream', 'payload.bin',
+                          b'0123456789abcdef')
+    assert b''.join(ndef.message_encoder([record])) == \
+        b''.join(ndef.message_encoder([generic]))
+    assert record == generic
+
+
+def test_str_reads_only_summary(path):
+    record = FileRecord('application/octet-stream', 'payload.bin', path, 16)
+    assert str(record) == \
+        "NDEF Record TYPE 'application/octet-stream' ID 'payload.bin' " \
+        "PAYLOAD 16 byte '30313233343536373839' ... 6 more"
+
+
+def test_missing_file_raises_click_exception(tmpdir):
+    path = str(tmpdir.join('missing.bin'))
+    record = FileRecord('application/octet-stream', 'missing.bin', path, 16)
+    with pytest.raises(click.ClickException) as excinfo:
+        record.data
+    assert "can not read payload of record 'missing.bin'" in str(excinfo.value)
@@ -2,8 +2,12 @@
 
 from __future__ import absolute_import, division
 
+import io
 import os
+import sys
+import subprocess
 import pytest
+import ndef
 from ndeftool.cli import main
 
 
@@ -130,6 +134,51 @@ def test_save_skip_count_head_tail(isolated_runner):
         b'\xda' + plain_text_records[2][1:]
 
 
+# A URI record, a text/plain record in three chunks and a URI record.
+chunked_records = (b'\x91\x01\x02U\x03a'
+                   b'\x32\x0a\x03text/plainone'
+                   b'\x36\x00\x03two'
+                   b'\x16\x00\x05three'
+                   b'\x51\x01\x02U\x03b')
+
+
+@pytest.mark.parametrize("select, octets", [
+    ('--skip 1 --tail 1', b''.join(plain_text_records)),
+    ('--skip 3 --head 4', b''.join(plain_text_records)),
+    ('--skip 1 --count 2 --tail 3', b''.join(plain_text_records)),
+    ('--head 2 --tail 1', b''.join(plain_text_records)),
+    ('--skip 5 --tail 1', b''.join(plain_text_records)),
+    ('--count 4 --tail 2', b''.join(plain_text_records)),
+    ('--skip 1 --head 1', chunked_records),
+    ('--skip 2 --head 1', chunked_records),
+    ('--skip 2 --tail 2', chunked_records),
+    ('--skip 1 --head 3', chunked_records),
+])
+@pytest.mark.parametrize("raw", [False, True])
+def test_save_selects_records_like_load(isolated_runner, select, octets,
+                                        raw):
+    open('records.ndef', 'wb').write(octets)
+    params = ['load'] + select.split() + ['records.ndef']
+    loaded = isolated_runner.invoke(main, params)
+    assert loaded.exit_code == 0
+    params = ['save'] + (['--raw'] if raw else []) + select.split()
+    result = isolated_runner.invoke(main, params + ['saved.ndef'],
+                                    input=octets)
+    assert result.exit_code == 0
+    assert open('saved.ndef', 'rb').read() == loaded.stdout_bytes
+
+
+def test_save_raw_divided_chunks_from_pipe(tmpdir):
+    # Standard input from a pipe can not seek and is recorded.
+    path = str(tmpdir.join('out.ndef'))
+    command = [sys.executable, '-c', 'from ndeftool.cli import main; main()',
+               '--silent', 'save', '--raw', '--skip', '2', '--head', '1',
+               path]
+    subprocess.run(command, input=chunked_records, check=True)
+    assert [record.data for record in ndef.message_decoder(
+        open(path, 'rb').read())] == [b'two']
+
+
 def test_save_do_not_overwrite_file(isolated_runner):
     open('hello.ndef', 'wb')
     octets = b''.join(plain_text_records)
@@ -185,3 +234,400 @@ def test_unpack_record_without_name(isolated_runner):
     result = isolated_runner.invoke(main, params, input=octets)
     assert result.exit_code == 0
     assert "Skipping 1 record without name" in result.output
+
+
+def test_stream_save_head_and_forward(isolated_runner):
+    octets = b''.join(plain_text_records)
+    params = '--stream --silent save --skip 1 --head 2 hello.ndef'.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert open('hello.ndef', 'rb').read() == \
+        b'\x9a' + plain_text_records[1][1:] + \
+        b'\x5a' + plain_text_records[2][1:]
+    assert result.stdout_bytes == \
+        plain_text_records[0] + b'\x1a' + plain_text_records[3][1:] + \
+        plain_text_records[4]
+
+
+def test_stream_save_tail_buffers_records(isolated_runner):
+    octets = b''.join(plain_text_records)
+    params = '--stream save --tail 2 hello.ndef'.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert open('hello.ndef', 'rb').read() == \
+        b'\x9a' + plain_text_records[3][1:] + plain_text_records[4]
+
+
+def test_stream_decode_error_removes_file(isolated_runner):
+    octets = b'\x9a\n\x0b\x02text/plainR1Hello World'
+    params = '--stream save hello.ndef'.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 1
+    assert "Error: ME flag not set in last record" in result.output
+    assert not os.path.exists('hello.ndef')
+
+
+@pytest.mark.parametrize("mode", ['--burst', '--unpack'])
+def test_write_files_with_jobs(isolated_runner, mode):
+    octets = b''.join(plain_text_records)
+    serial = isolated_runner.invoke(main, ['save', mode, 'serial'],
+                                    input=octets)
+    params = ['save', '--jobs', '3', mode, 'parallel']
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == serial.exit_code == 0
+    assert sorted(os.listdir('parallel')) == sorted(os.listdir('serial'))
+    for name in os.listdir('serial'):
+        assert open('parallel/' + name, 'rb').read() == \
+            open('serial/' + name, 'rb').read()
+
+
+def write_same_name_records(filename):
+    records = [ndef.Record('text/plain', 'same.txt', 1000000 * b'A'),
+               ndef.Record('text/plain', 'same.txt', b'B')]
+    open(filename, 'wb').write(b''.join(ndef.message_encoder(records)))
+
+
+@pytest.mark.parametrize("jobs", ['1', '4'])
+def test_unpack_same_name_with_jobs(isolated_runner, jobs):
+    write_same_name_records('same.ndef')
+    params = ['load', 'same.ndef', 'save', '--unpack', '--jobs', jobs, 'out']
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert open('out/same.txt', 'rb').read() == b'B'
+
+
+@pytest.mark.parametrize("jobs", ['1', '2'])
+def test_unpack_absolute_record_name(isolated_runner, jobs):
+    octets = b'\xda\n\x0b\x07text/plain/R1.txtHello World'
+    params = ['save', '--unpack', '--jobs', jobs, 'hello']
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert open('hello/R1.txt').read() == "Hello World"
+
+
+def test_unpack_write_error(isolated_runner):
+    octets = b'\xda\n\x0b\x04text/plainR1/xHello World'
+    params = 'save --unpack --jobs 2 hello'.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 1
+    assert "Error: [Errno 2] No such file or directory" in result.output
+
+
+@pytest.mark.parametrize("fsync, files, dirs", [
+    ('none', 0, 0), ('dir', 0, 1), ('file', 5, 1),
+])
+def test_burst_with_fsync_policy(isolated_runner, monkeypatch,
+                                 fsync, files, dirs):
+    import stat
+    synced = []
+
+    def fsync_fd(fd):
+        synced.append(stat.S_ISDIR(os.fstat(fd).st_mode))
+
+    monkeypatch.setattr(os, 'fsync', fsync_fd)
+    octets = b''.join(plain_text_records)
+    params = ['save', '--burst', '--fsync', fsync, 'hello']
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert synced.count(False) == files
+    assert synced.count(True) == dirs
+
+
+@pytest.mark.parametrize("params", [
+    'text Hello save -', 'save -', 'save --raw -',
+])
+def test_save_message_to_standard_output(isolated_runner, params):
+    octets = b'\xd1\x01\x08T\x02enHello'
+    params = ['--silent'] + params.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert result.stdout_bytes == octets
+
+
+def test_save_message_with_fsync(isolated_runner, monkeypatch):
+    synced = []
+    monkeypatch.setattr(os, 'fsync', synced.append)
+    octets = b''.join(plain_text_records)
+    params = 'save --fsync file hello.ndef'.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert len(synced) == 2
+    assert open('hello.ndef', 'rb').read() == octets
+
+
+def test_sync_requires_burst_or_unpack(isolated_runner):
+    octets = b''.join(plain_text_records)
+    result = isolated_runner.invoke(main, 'save --sync hello.ndef'.split(),
+                                    input=octets)
+    assert result.exit_code == 1
+    assert "Error: '--sync' requires '--burst', '--unpack' or " \
+        "'--max-bytes'." in result.output
+
+
+@pytest.mark.parametrize("jobs", ['1', '3'])
+def test_sync_updates_changed_files(isolated_runner, jobs):
+    os.mkdir('hello')
+    os.mkdir('hello/old')
+    open('hello/R1', 'w').write("Hello World")
+    open('hello/R2', 'w').write("Hello Earth")
+    open('hello/R3', 'w').write("Hello")
+    open('hello/R9', 'w').write("Stale")
+    open('hello/old/R0', 'w').write("Stale")
+    inode = os.stat('hello/R1').st_ino
+    octets = b''.join(plain_text_records)
+    params = ['save', '--sync', '--force', '--jobs', jobs, '--unpack',
+              'hello']
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert "Synced hello: 4 written, 1 unchanged, 2 removed." \
+        in result.stderr
+    assert sorted(os.listdir('hello')) == ['R1', 'R2', 'R3', 'R4', 'R5']
+    for index in range(len(plain_text_records)):
+        assert open('hello/R%d' % (index+1)).read() == "Hello World"
+    assert os.stat('hello/R1').st_ino == inode
+
+
+@pytest.mark.parametrize("jobs", ['1', '4'])
+def test_sync_same_name_with_jobs(isolated_runner, jobs):
+    write_same_name_records('same.ndef')
+    os.mkdir('out')
+    open('out/same.txt', 'w').write('B')
+    params = ['load', 'same.ndef', 'save', '--sync', '--force', '--unpack',
+              '--jobs', jobs, 'out']
+    for _ in range(3):
+        result = isolated_runner.invoke(main, params)
+        assert result.exit_code == 0
+        assert "Synced out: 2 written, 0 unchanged, 0 removed." \
+            in result.stderr
+        assert os.listdir('out') == ['same.txt']
+        assert open('out/same.txt', 'rb').read() == b'B'
+
+
+def test_sync_existing_directory_requires_force(isolated_runner):
+    os.mkdir('hello')
+    os.mkdir('hello/docs')
+    open('hello/important.doc', 'w').write("Keep")
+    open('hello/docs/thesis.tex', 'w').write("Keep")
+    octets = b''.join(plain_text_records)
+    params = 'save --sync --unpack hello'.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 1
+    assert "Error: path 'hello' exists. Use '--force' to replace." \
+        in result.output
+    assert open('hello/important.doc').read() == "Keep"
+    assert open('hello/docs/thesis.tex').read() == "Keep"
+
+
+def test_sync_creates_directory(isolated_runner):
+    octets = b''.join(plain_text_records)
+    params = 'save --sync --burst hello'.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert "Synced hello: 5 written, 0 unchanged, 0 removed." \
+        in result.stderr
+    assert len(os.listdir('hello')) == 5
+
+
+def test_sync_with_cache_skips_reading_files(isolated_runner, monkeypatch):
+    from ndeftool.commands import Save
+    hashed = []
+    hash_file = Save.hash_file
+    monkeypatch.setattr(Save, 'hash_file', lambda *args: hashed.append(
+        args) or hash_file(*args))
+    octets = b''.join(plain_text_records)
+    params = '--cache-dir cache save --sync -f --unpack hello'.split()
+    for _ in range(3):
+        result = isolated_runner.invoke(main, params, input=octets)
+        assert result.exit_code == 0
+    assert "Synced hello: 0 written, 5 unchanged, 0 removed." \
+        in result.stderr
+    assert hashed == []
+
+
+@pytest.mark.parametrize("archive", [
+    'hello.zip', 'hello.tar', 'hello.tar.gz', 'hello.tar.bz2',
+    'hello.tar.xz',
+])
+def test_unpack_records_to_archive(isolated_runner, archive):
+    import tarfile
+    import zipfile
+    octets = b''.join(plain_text_records)
+    params = ['save', '--unpack', '--archive', archive]
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert "Saving 5 records to archive %s." % archive in result.stderr
+    if archive.endswith('.zip'):
+        with zipfile.ZipFile(archive) as f:
+            members = [(name, f.read(name)) for name in f.namelist()]
+    else:
+        with tarfile.open(archive) as f:
+            members = [(m.name, f.extractfile(m).read()) for m in f]
+    assert members == [('R%d' % index, b'Hello World')
+                       for index in range(1, 6)]
+
+
+def test_burst_records_to_archive_on_stdout(isolated_runner):
+    import io
+    import tarfile
+    octets = b''.join(plain_text_records)
+    params = 'save --burst --archive -'.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    with tarfile.open(fileobj=io.BytesIO(result.stdout_bytes)) as f:
+        members = [(m.name, f.extractfile(m).read()) for m in f]
+    assert members == [('%03d.ndef' % index, b'\xda' + record[1:])
+                       for index, record in enumerate(plain_text_records)]
+
+
+def test_burst_archive_loads_back(isolated_runner):
+    octets = b''.join(plain_text_records)
+    params = 'save --burst --archive hello.tar.gz'.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    params = '--silent load --archive hello.tar.gz'.split()
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    assert result.stdout_bytes == octets
+
+
+@pytest.mark.parametrize("options, errmsg", [
+    ('--archive',
+     "'--archive' requires '--burst', '--unpack' or '--max-bytes'."),
+    ('--archive --sync --burst', "'--sync' can not be used with '--archive'."),
+])
+def test_archive_option_errors(isolated_runner, options, errmsg):
+    params = ['save'] + options.split() + ['hello.tar']
+    result = isolated_runner.invoke(main, params, input=b'')
+    assert result.exit_code == 1
+    assert "Error: " + errmsg in result.output
+
+
+class PipeInput(io.RawIOBase):
+    # A binary input stream that can not seek, like a pipe.
+    def __init__(self, octets):
+        self.stream = io.BytesIO(octets)
+
+    def readinto(self, buffer):
+        return self.stream.readinto(buffer)
+
+    def readable(self):
+        return True
+
+
+@pytest.mark.parametrize("pipe", [False, True])
+@pytest.mark.parametrize("options", [
+    '', '--head 1', '--tail 1', '--skip 4', '--skip 9', '--tail 3 --head 2',
+    '--skip 1 --count 3 --head 2 --tail 1',
+])
+def test_raw_copy_equals_decoded(isolated_runner, options, pipe):
+    octets = b''.join(plain_text_records)
+    params = ['save'] + options.split() + ['decoded.ndef']
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    params = ['save', '--raw'] + options.split() + ['raw.ndef']
+    stdin = PipeInput(octets) if pipe else octets
+    result = isolated_runner.invoke(main, params, input=stdin)
+    assert result.exit_code == 0
+    assert open('raw.ndef', 'rb').read() == open('decoded.ndef', 'rb').read()
+
+
+def test_raw_copy_first_message_only(isolated_runner):
+    octets = b'\xda\n\x0b\x02text/plainR1Hello World'
+    params = 'save --raw hello.ndef'.split()
+    result = isolated_runner.invoke(main, params, input=octets + octets)
+    assert result.exit_code == 0
+    assert open('hello.ndef', 'rb').read() == octets
+
+
+def test_raw_copy_keeps_record_encoding(isolated_runner):
+    # A long record encoding of a short payload is not encoded again.
+    octets = b'\xca\n\x00\x00\x00\x0b\x02text/plainR1Hello World'
+    params = 'save --raw hello.ndef'.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert open('hello.ndef', 'rb').read() == octets
+
+
+def test_raw_copy_with_errors(isolated_runner):
+    octets = b''.join(plain_text_records[1:])
+    params = 'save --raw hello.ndef'.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 1
+    assert "Error: MB flag not set in first record" in result.output
+    params = '--relax save --raw hello.ndef'.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert open('hello.ndef', 'rb').read() == b'\x9a' + octets[1:]
+    params = '--relax save --raw --force hello.ndef'.split()
+    result = isolated_runner.invoke(main, params, input=octets[:-1])
+    assert result.exit_code == 1
+    assert "Error: truncated record at offset 81" in result.output
+
+
+@pytest.mark.parametrize("params, errmsg", [
+    ('save --raw --keep hello.ndef',
+     "'--raw' can not be used with '--keep'."),
+    ('save --raw --burst hello',
+     "'--raw' can not be used with '--burst'."),
+    ('text Hello save --raw hello.ndef',
+     "'--raw' requires save to be the first command."),
+])
+def test_raw_option_errors(isolated_runner, params, errmsg):
+    result = isolated_runner.invoke(main, params.split(), input=b'')
+    assert result.exit_code == 1
+    assert "Error: " + errmsg in result.output
+
+
+def test_pack_records_into_messages(isolated_runner):
+    # Records of 27 octets, two fit into a message of 60 octets.
+    octets = b''.join(plain_text_records)
+    params = 'save --max-bytes 60 hello'.split()
+    result = isolated_runner.invoke(main, params, input=octets)
+    assert result.exit_code == 0
+    assert sorted(os.listdir('hello')) == ['000.ndef', '001.ndef', '002.ndef']
+    assert open('hello/000.ndef', 'rb').read() == \
+        plain_text_records[0] + b'Z' + plain_text_records[1][1:]
+    assert open('hello/001.ndef', 'rb').read() == \
+        b'\x9a' + plain_text_records[2][1:] + b'Z' + plain_text_records[3][1:]
+    assert open('hello/002.ndef', 'rb').read() == \
+        b'\xda' + plain_text_records[4][1:]
+
+
+def test_pack_records_first_fit_decreasing(isolated_runner):
+    # Text records of 7, 8, 13 and 9 octets need three messages of 20
+    # octets when packed in input order, in decreasing size two.
+    params = 'text 1 text 123456 text 12 save -m 20 hello'.split()
+    result = isolated_runner.invoke(main, ['text', ''] + params)
+    assert result.exit_code == 0
+    assert sorted(os.listdir('hello')) == ['000.ndef', '001.ndef']
+    params = '--silent load hello/000.ndef print'.split()
+    result = isolated_runner.invoke(main, params)
+    assert "Text '' " in result.output and "Text '123456' " in result.output
+    params = '--silent load hello/001.ndef print'.split()
+    result = isolated_runner.invoke(main, params)
+    assert "Text '1' " in result.output and "Text '12' " in result.output
+
+
+def test_pack_records_for_tag_type(isolated_runner):
+    params = 'text Hello save --tag ntag213 --archive hello.zip'.split()
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 0
+    import zipfile
+    assert zipfile.ZipFile('hello.zip').namelist() == ['000.ndef']
+
+
+@pytest.mark.parametrize("options, errmsg", [
+    ('--max-bytes 10',
+     "record 0 encodes to 12 octets, more than 10 octets."),
+    ('--tag ultralight --max-bytes 10',
+     "'--max-bytes' can not be used with '--tag'."),
+    ('--tag ultralight --burst',
+     "'--burst' can not be used with '--tag'."),
+    ('--max-bytes 10 --unpack',
+     "'--unpack' can not be used with '--max-bytes'."),
+])
+def test_pack_records_errors(isolated_runner, options, errmsg):
+    params = ['text', 'Hello', 'save'] + options.split() + ['hello']
+    result = isolated_runner.invoke(main, params)
+    assert result.exit_code == 1
+    assert "Error: " + errmsg in result.output
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division
+
+import os
+import sys
+import time
+import signal
+import subprocess
+import pytest
+from ndeftool.cli import main
+from ndeftool import daemon
+
+
+@pytest.fixture
+def runner():
+    import click.testing
+    return click.testing.CliRunner()
+
+
+@pytest.fixture
+def server(tmpdir):
+    path = str(tmpdir.join('ndeftool.sock'))
+    command = [sys.executable, '-c', 'from ndeftool.cli import main; main()',
+               '--silent', 'serve', '--socket', path]
+    process = subprocess.Popen(command)
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+    yield path
+    process.send_signal(signal.SIGINT)
+    process.wait()
+    assert not os.path.exists(path)
+
+
+def test_help_option_prints_usage(runner):
+    result = runner.invoke(main, ['serve', '--help'])
+    assert result.exit_code == 0
+    assert result.output.startswith('Usage: main serve [OPTIONS]')
+
+
+def test_abbreviated_command_name(runner):
+    result = runner.invoke(main, ['sv', '--help'])
+    assert result.exit_code == 0
+    assert result.output.startswith('Usage: main sv [OPTIONS]')
+
+
+def test_socket_option_is_required(runner):
+    result = runner.invoke(main, ['serve'])
+    assert result.exit_code == 2
+    assert "Missing option '-S' / '--socket'" in result.output
+
+
+def test_do_not_replace_existing_path(runner, tmpdir):
+    path = str(tmpdir.join('ndeftool.sock'))
+    open(path, 'w').close()
+    result = runner.invoke(main, ['serve', '--socket', path])
+    assert result.exit_code == 1
+    assert "Error: path '%s' exists." % path in result.output
+
+
+def test_serve_pipeline_request(server):
+    status, stdout, stderr = daemon.request(server, ['text', 'Hello'])
+    assert status == 0
+    assert stdout == b'\xd1\x01\x08T\x02enHello'
+    assert stderr == b''
+
+
+def test_serve_pipeline_with_stdin(server):
+    octets = b'\xd1\x01\x08T\x02enHello'
+    args = ['--silent', 'print']
+    status, stdout, stderr = daemon.request(server, args, octets)
+    assert status == 0
+    assert stdout == b"NDEF Text Record ID '' Text 'Hello' " \
+                     b"Language 'en' Encoding 'UTF-8'\n"
+
+
+def test_serve_requests_do_not_share_options(server):
+    octets = b'\x11\x01\x08T\x02enHello'
+    status, stdout, stderr = daemon.request(server, ['--relax', 'print'],
+                                            octets)
+    assert status == 0
+    status, stdout, stderr = daemon.request(server, ['print'], octets)
+    assert status == 1
+    assert b'Error: MB flag not set in first record' in stderr
+
+
+def test_serve_pipeline_usage_error(server):
+    status, stdout, stderr = daemon.request(server, ['unknown-command'])
+    assert status == 2
+    assert b"Error: No such command 'unknown-command'." in stderr
+
+
+def test_client_runs_locally_without_server(tmpdir):
+    env = dict(os.environ)
+    env[daemon.SOCKET_ENVVAR] = str(tmpdir.join('missing.sock'))
+    command = [sys.executable, '-c',
+               'from ndeftool.daemon import client_main; client_main()',
+               'text', 'Hello']
+    output = subprocess.check_output(command, env=env)
+    assert output == b'\xd1\x01\x08T\x02enHello'
+
+
+def test_client_sends_request_to_server(server):
+    env = dict(os.environ)
+    env[daemon.SOCKET_ENVVAR] = server
+    command = [sys.executable, '-c',
+               'from ndeftool.daemon import client_main; client_main()',
+               'load', '--pack', '-']
+    process = subprocess.Popen(command, env=env, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE)
+    stdout, _ = process.communicate(b'Hello World')
+    assert process.returncode == 0
+    assert stdout == b'\xda\n\x0b\x07text/plain<stdin>Hello World'
+
+
+def test_client_leaves_unread_stdin_open(server):
+    env = dict(os.environ)
+    env[daemon.SOCKET_ENVVAR] = server
+    command = [sys.executable, '-c',
+               'from ndeftool.daemon import client_main; client_main()',
+               'text', 'Hello']
+    process = subprocess.Popen(command, env=env, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE)
+    try:
+        # The pipeline does not read stdin, which is never closed.
+        assert process.wait(timeout=10) == 0
+        assert process.stdout.read() == b'\xd1\x01\x08T\x02enHello'
+    finally:
+        process.kill()
+        process.stdin.close()
+        process.stdout.close()
+
+
+def test_serve_reads_stdin_only_when_needed(server):
+    class Input(object):
+        def read(self):
+            raise AssertionError("stdin read")
+    status, stdout, stderr = daemon.request(server, ['text', 'Hello'],
+                                            Input())
+    assert status == 0
+    assert stdout == b'\xd1\x01\x08T\x02enHello'
+
+
+def test_client_runs_in_its_working_directory(server, tmpdir):
+    env = dict(os.environ)
+    env[daemon.SOCKET_ENVVAR] = server
+    # The package must be found from another working directory.
+    package = os.path.dirname(os.path.dirname(daemon.__file__))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package] + env.get('PYTHONPATH', '').split(os.pathsep))
+    command = [sys.executable, '-c',
+               'from ndeftool.daemon import client_main; client_main()',
+               'text', 'Hello', 'save', 'rel.ndef']
+    subprocess.check_call(command, env=env, cwd=str(tmpdir))
+    assert tmpdir.join('rel.ndef').read_binary() == \
+        b'\xd1\x01\x08T\x02enHello'
+
+
+def test_serve_request_environment(server, tmpdir):
+    env = {'NDEFTOOL_CACHE_DIR': str(tmpdir.join('cache'))}
+    status, stdout, stderr = daemon.request(server, ['cache', 'stats'],
+                                            env=env)
+    assert status == 0
+    assert stdout.startswith(b'table')
+    status, stdout, stderr = daemon.request(server, ['cache', 'stats'],
+                                            env={})
+    assert status == 1
+    assert b"Error: no cache directory" in stderr
+
+
+def test_serve_request_exception(tmpdir):
+    import threading
+    path = str(tmpdir.join('ndeftool.sock'))
+
+    def handler(args, stdin):
+        if args == ['fail']:
+            raise RuntimeError("request failed")
+        return 0, b'done', b''
+
+    thread = threading.Thread(target=daemon.serve, args=(path, handler))
+    thread.daemon = True
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+    status, stdout, stderr = daemon.request(path, ['fail'])
+    assert status == 1
+    assert b'RuntimeError: request failed' in stderr
+    assert daemon.request(path, ['pass']) == (0, b'done', b'')
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division
+
+import os
+import sys
+import timeit
+import subprocess
+import pytest
+
+# The startup budget is the time in seconds that an ndeftool run may
+# take in addition to a bare interpreter that imports click and ndef.
+# The minimum of repeated runs is compared to reduce timing noise.
+STARTUP_BUDGET = float(os.environ.get('NDEFTOOL_STARTUP_BUDGET', '0.05'))
+
+ndeftool = [sys.executable, '-c', 'from ndeftool.cli import main; main()']
+
+
+def startup_time(command, env=None, repeat=10):
+    def run():
+        subprocess.check_call(command, stdout=subprocess.DEVNULL, env=env)
+    run()  # the first run writes the bytecode cache
+    return min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+@pytest.fixture(scope='module')
+def bytecode_env(tmpdir_factory):
+    # An installed ndeftool runs from compiled bytecode, which may be
+    # disabled for the tests. A separate cache keeps the tree clean.
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPYCACHEPREFIX'] = str(tmpdir_factory.mktemp('pycache'))
+    return env
+
+
+@pytest.fixture(scope='module')
+def baseline(bytecode_env):
+    return startup_time([sys.executable, '-c', 'import click, ndef'],
+                        bytecode_env)
+
+
+def test_text_command_does_not_import_magic():
+    script = ("import sys; from ndeftool.cli import main\n"
+              "try: main(['text', 'foo'])\n"
+              "except SystemExit: pass\n"
+              "assert 'magic' not in sys.modules")
+    subprocess.check_call([sys.executable, '-c', script],
+                          stdout=subprocess.DEVNULL)
+
+
+@pytest.mark.parametrize("args", [
+    ['--version'],
+    ['text', 'foo'],
+])
+def test_startup_time_within_budget(baseline, bytecode_env, args):
+    elapsed = startup_time(ndeftool + args, bytecode_env)
+    assert elapsed - baseline < STARTUP_BUDGET, \
+        "startup of 'ndeftool %s' took %.3f sec, baseline is %.3f sec" % (
+            ' '.join(args), elapsed, baseline)
+
+
+def test_load_save_startup_within_budget(baseline, bytecode_env, tmpdir):
+    source = tmpdir.join('in.ndef')
+    source.write_binary(b'\xd1\x01\x08T\x02enHello')
+    args = ['load', str(source), 'save', '--force', str(tmpdir.join('out'))]
+    elapsed = startup_time(ndeftool + args, bytecode_env)
+    assert elapsed - baseline < STARTUP_BUDGET, \
+        "startup of 'ndeftool load FILE save FILE' took %.3f sec, " \
+        "baseline is %.3f sec" % (elapsed, baseline)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division
+
+import os
+import glob
+import threading
+import pytest
+from ndeftool import watch
+
+
+@pytest.fixture(params=['inotify', 'polling'])
+def watcher(request, tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(watch, 'POLL_INTERVAL', 0.05)
+    monkeypatch.setattr(watch, 'SETTLE_TIME', 0.05)
+    if request.param == 'polling':
+        monkeypatch.setattr(watch.Inotify, 'open', classmethod(
+            lambda cls: None))
+    watcher = watch.Watcher()
+    yield watcher
+    watcher.close()
+
+
+def select_files():
+    return sorted(glob.glob('*.txt'))
+
+
+def wait_for(watcher, change):
+    timer = threading.Timer(0.1, change)
+    timer.start()
+    try:
+        watcher.wait()
+    finally:
+        timer.join()
+
+
+def test_watch_returns_selected_files(watcher):
+    open('a.txt', 'w').write('a')
+    open('b.txt', 'w').write('b')
+    assert watcher.watch(select_files, ['.']) == ['a.txt', 'b.txt']
+
+
+@pytest.mark.parametrize("change", [
+    lambda: open('a.txt', 'w').write('changed'),
+    lambda: open('c.txt', 'w').write('new'),
+    lambda: os.remove('a.txt'),
+])
+def test_wait_returns_after_change(watcher, change):
+    open('a.txt', 'w').write('a')
+    watcher.watch(select_files, ['.'])
+    wait_for(watcher, change)
+
+
+def test_wait_ignores_unselected_files(watcher):
+    open('a.txt', 'w').write('a')
+    watcher.watch(select_files, ['.'])
+    changes = [lambda: open('a.txt', 'w').write('changed'),
+               lambda: open('output.ndef', 'w').write('ignored')]
+    wait_for(watcher, lambda: [change() for change in reversed(changes)])
+    assert watcher.snapshot['a.txt'][0] == len('changed')
+
+
+def test_load_keeps_records_of_unchanged_files(watcher):
+    open('a.txt', 'w').write('a')
+    loaded = []
+
+    def load_records():
+        loaded.append(1)
+        return [bytearray(b'record')]
+
+    first = watcher.load('a.txt', (), load_records)
+    second = watcher.load('a.txt', (), load_records)
+    assert first == second == [bytearray(b'record')]
+    assert first[0] is not second[0]
+    assert len(loaded) == 1
+    watcher.load('a.txt', ('other options',), load_records)
+    assert len(loaded) == 2
+    os.utime('a.txt', ns=(0, 0))
+    watcher.load('a.txt', (), load_records)
+    assert len(loaded) == 3
+
+
+def test_wait_forgets_records_not_loaded_again(watcher):
+    open('a.txt', 'w').write('a')
+    open('b.txt', 'w').write('b')
+    watcher.watch(select_files, ['.'])
+    watcher.load('a.txt', (), lambda: [1])
+    watcher.load('b.txt', (), lambda: [2])
+    wait_for(watcher, lambda: open('b.txt', 'w').write('changed'))
+    watcher.begin()
+    watcher.load('a.txt', (), lambda: [1])
+    wait_for(watcher, lambda: open('a.txt', 'w').write('changed'))
+    assert [key[0] for key in watcher.records] == ['a.txt']